@@ -0,0 +1,251 @@
+import re
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# =============================================
+# FUNÇÕES PURAS SOBRE OS DADOS (sem Streamlit nem Drive; testadas em tests/)
+# =============================================
+
+# ---------- Horas ----------
+
+# um lançamento vai de 1 minuto a 24 horas
+MINUTOS_DIA = 24 * 60
+
+
+def formatar_horas(horas_input):
+    if horas_input is None or str(horas_input).strip() == "":
+        return None
+    horas_input = str(horas_input).strip().replace(",", ".")
+    pattern = re.fullmatch(r"(\d{1,2})[:;.,](\d{1,2})", horas_input)
+    if pattern:
+        h, m = map(int, pattern.groups())
+        if 0 <= h < 24 and 0 <= m < 60:
+            return f"{h:02d}:{m:02d}"
+    try:
+        decimal = float(horas_input)
+        total_min = int(round(decimal * 60))
+        h = total_min // 60
+        m = total_min % 60
+        return f"{h:02d}:{m:02d}"
+    except Exception:
+        return None
+
+
+def interpretar_horas(serie: pd.Series):
+    # versão vetorizada de formatar_horas (mesmo resultado, valor a valor): devolve o texto
+    # HH:MM e os minutos (Int64). A coluna repete poucos valores: cada valor distinto é
+    # interpretado uma vez e o resultado volta às linhas pelos códigos do factorize.
+    # Os formatos comuns (H:MM, h;m, h.m e horas decimais) são resolvidos em bloco; o que
+    # sobra (expoente, dígitos não ASCII, inválidos) passa pelo próprio formatar_horas.
+    # Só valores absurdos, grandes demais para int64, ficam com o texto e sem os minutos.
+    # Vazios (None/NaN/NA) não passam por astype(str), que os trata de um jeito em cada
+    # versão do pandas: o factorize dá código -1 e a posição extra no fim responde None/NA
+    codigos, distintos = pd.factorize(serie, use_na_sentinel=True)
+    texto = pd.Series([str(v) for v in distintos], dtype=object).str.strip().str.replace(",", ".", regex=False)
+    minutos = pd.Series(np.nan, index=texto.index)
+
+    partes = texto.str.extract(r"\A([0-9]{1,2})[:;.]([0-9]{1,2})\Z").astype(float)
+    hm = partes[0].lt(24) & partes[1].lt(60)
+    minutos[hm] = partes[0] * 60 + partes[1]
+
+    valores = texto.where(~hm & texto.str.fullmatch(r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)").fillna(False)).astype(float)
+    decimal = valores.abs() < 1e12
+    minutos[decimal] = np.round(valores * 60)
+
+    minutos = minutos.astype("Int64")
+    formatado = (minutos // 60).astype(str).str.zfill(2) + ":" + (minutos % 60).astype(str).str.zfill(2)
+    formatado = formatado.astype(object).where(minutos.notna(), None)
+
+    resto = ~(hm | decimal)
+    if resto.any():
+        formatado[resto] = [formatar_horas(v) for v in texto[resto]]
+        minutos[resto] = [
+            int(f.split(":")[0]) * 60 + int(f.split(":")[1]) if f is not None and len(f) < 15 else pd.NA
+            for f in formatado[resto]
+        ]
+    formatado = np.append(formatado.to_numpy(dtype=object), None)
+    minutos = pd.concat([minutos, pd.Series([pd.NA], dtype="Int64")], ignore_index=True)
+    return (pd.Series(formatado[codigos], index=serie.index, dtype=object),
+            pd.Series(minutos.array.take(codigos), index=serie.index))
+
+
+def minutos_horas(horas_input):
+    # minutos de formatar_horas(horas_input); None se inválido
+    horas = formatar_horas(horas_input)
+    if horas is None:
+        return None
+    h, m = horas.split(":")
+    return int(h) * 60 + int(m)
+
+
+def minutos_validos(minutos):
+    # regra de todas as entradas de horas (0 < minutos <= MINUTOS_DIA; vazio é inválido):
+    # escalar nos formulários, Series na grade semanal e na importação
+    if isinstance(minutos, pd.Series):
+        numeros = pd.to_numeric(minutos, errors="coerce")
+        return (numeros.gt(0) & numeros.le(MINUTOS_DIA)).fillna(False).astype(bool)
+    return minutos is not None and not pd.isna(minutos) and 0 < minutos <= MINUTOS_DIA
+
+
+def completar_minutos(df):
+    # Minutos (inteiro) é o que as consultas somam; Horas Gastas fica como texto de exibição.
+    # Só as linhas sem Minutos (anteriores à coluna ou editadas à mão no CSV, com a célula
+    # apagada) têm as horas interpretadas, já normalizando o texto
+    if "Horas Gastas" not in df.columns:
+        return df
+    minutos = pd.to_numeric(df["Minutos"], errors="coerce") if "Minutos" in df.columns else pd.Series(np.nan, index=df.index)
+    minutos = minutos.round().astype("Int64")
+    faltando = minutos.isna() & df["Horas Gastas"].notna()
+    if faltando.any():
+        texto, calculados = interpretar_horas(df.loc[faltando, "Horas Gastas"])
+        df.loc[faltando, "Horas Gastas"] = texto
+        minutos[faltando] = calculados
+    df["Minutos"] = minutos
+    return df
+
+
+# ---------- Linhas ----------
+
+def gerar_id_unico():
+    return str(uuid.uuid4())
+
+
+def texto_coluna(serie: pd.Series):
+    # números inteiros vindos do Excel como float (1000.0) voltam a "1000"
+    if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype("Int64")
+    return serie.astype("string").str.strip().replace("", pd.NA)
+
+
+def concat_rows(frames, colunas=None):
+    # junta as partes de uma base (partições, deltas do journal) num DataFrame novo: as partes
+    # vêm do cache de leitura, compartilhado entre as sessões, e quem recebe o resultado pode
+    # alterá-lo no lugar. colunas: só essas (o Dashboard não leva Observações). Categóricas
+    # com categorias diferentes entre as partes virariam object no concat: todas passam à
+    # união delas. Partes vazias ficam de fora (só mudariam os tipos do resultado)
+    if colunas is not None:
+        frames = [f[[c for c in f.columns if c in colunas]] for f in frames]
+    frames = [f for f in frames if len(f)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].copy()
+    categoricas = {c for f in frames for c in f.columns if isinstance(f[c].dtype, pd.CategoricalDtype)}
+    uniao = {}
+    for c in categoricas:
+        valores = [f[c].cat.categories if isinstance(f[c].dtype, pd.CategoricalDtype) else pd.Index(f[c].dropna().unique())
+                   for f in frames if c in f.columns]
+        valores = [v for v in valores if len(v)]
+        uniao[c] = pd.CategoricalDtype(valores[0].append(valores[1:]).unique() if valores else [])
+    if uniao:
+        frames = [f.astype({c: d for c, d in uniao.items() if c in f.columns}) for f in frames]
+    df = pd.concat(frames, ignore_index=True)
+    if 'ID' in df.columns:
+        df = df.drop_duplicates(subset=['ID'], keep='last').reset_index(drop=True)
+    return df
+
+
+# ---------- Cubo do Dashboard ----------
+
+def rollup_cubo(df: pd.DataFrame, dimensoes):
+    # linhas da base -> linhas do cubo (Dia em ISO); linhas sem data válida ficam de fora
+    dia = pd.to_datetime(df['Data'], errors='coerce', format='%Y-%m-%d')
+    linhas = pd.DataFrame({
+        "Dia": dia.dt.strftime('%Y-%m-%d'),
+        **{d: df[d].astype(object) if d in df.columns else None for d in dimensoes},
+        "Minutos": pd.to_numeric(df["Minutos"], errors="coerce") if "Minutos" in df.columns else 0,
+        "Quantidade": pd.to_numeric(df["Quantidade"], errors="coerce") if "Quantidade" in df.columns else 0,
+        "Registros": 1,
+    })[dia.notna()]
+    return (linhas.groupby(["Dia", *dimensoes], dropna=False, as_index=False)[["Minutos", "Quantidade", "Registros"]]
+            .sum().astype({"Minutos": "int64", "Quantidade": "int64", "Registros": "int64"}))
+
+
+def concat_cubos(frames, dimensoes, periodo=None):
+    # cubos salvos voltam do CSV com códigos numéricos (Empresa 1000 como int) e os rollups do
+    # journal vêm da base tipada (texto): as dimensões passam a texto, parte a parte, antes de
+    # juntar, senão a mesma empresa vira duas categorias (1000 e "1000") e a ordenação quebra
+    frames = [f.assign(**{d: texto_coluna(f[d]) for d in dimensoes}) for f in frames]
+    cubo = pd.concat(frames, ignore_index=True)
+    cubo["Data"] = pd.to_datetime(cubo["Dia"], format='%Y-%m-%d')
+    if periodo:
+        cubo = cubo[(cubo["Data"] >= pd.Timestamp(periodo[0])) & (cubo["Data"] <= pd.Timestamp(periodo[1]))]
+    # dimensões categóricas: os filtros comparam códigos
+    return cubo.drop(columns="Dia").astype({d: "category" for d in dimensoes}).reset_index(drop=True)
+
+
+# ---------- Importação ----------
+
+def validar_importacao_timesheet(df_origem: pd.DataFrame, mapa: dict, usuarios: dict,
+                                 df_empresas: pd.DataFrame, df_projetos: pd.DataFrame, df_atividades: pd.DataFrame):
+    # mapa: coluna da base -> coluna do arquivo (None = não mapeada).
+    # Validação vetorizada; devolve (linhas válidas no formato da base, erros por linha)
+    df_origem = df_origem.reset_index(drop=True)
+    vazia = pd.Series(pd.NA, index=df_origem.index, dtype="string")
+
+    def origem(coluna):
+        return texto_coluna(df_origem[mapa[coluna]]) if mapa.get(coluna) else vazia
+
+    problemas = pd.Series("", index=df_origem.index)
+
+    def marcar(mask, msg):
+        nonlocal problemas
+        problemas = problemas.mask(mask.fillna(True).astype(bool), problemas + msg + "; ")
+
+    usuario = origem("Usuário")
+    marcar(~usuario.isin(list(usuarios)), "Usuário desconhecido")
+    nomes = usuario.map({u: d["name"] for u, d in usuarios.items()}).astype("string")
+    nome = origem("Nome").fillna(nomes)
+
+    if mapa.get("Data") and pd.api.types.is_datetime64_any_dtype(df_origem[mapa["Data"]]):
+        datas = df_origem[mapa["Data"]]
+    else:
+        bruto = origem("Data")
+        datas = pd.to_datetime(bruto, errors="coerce", format="%Y-%m-%d")
+        datas = datas.fillna(pd.to_datetime(bruto, errors="coerce", format="%d/%m/%Y"))
+    marcar(datas.isna(), "Data inválida")
+
+    # HH:MM:SS (Excel) perde os segundos
+    horas_brutas = origem("Horas Gastas").str.replace(r"^(\d{1,2}:\d{2}):\d{2}$", r"\1", regex=True)
+    horas, minutos = interpretar_horas(horas_brutas)
+    marcar(horas.isna(), "Horas inválidas")
+    marcar(horas.notna() & ~minutos_validos(minutos), "Horas fora de 1 minuto a 24 horas")
+
+    empresa = origem("Empresa")
+    marcar(~empresa.isin(set(texto_coluna(df_empresas["Codigo SAP"]).dropna())), "Empresa não cadastrada")
+    projeto = origem("Projeto")
+    marcar(~projeto.isin(set(df_projetos["Nome Projeto"].dropna().astype(str))), "Projeto não cadastrado")
+    atividade = origem("Atividade")
+    pares = pd.MultiIndex.from_frame(df_atividades[["Projeto Vinculado", "Nome Atividade"]].astype(str))
+    marcar(pd.Series(~pd.MultiIndex.from_arrays([projeto.fillna(""), atividade.fillna("")]).isin(pares), index=df_origem.index),
+           "Atividade não vinculada ao projeto")
+
+    time_por_projeto = (
+        df_projetos.dropna(subset=["Nome Projeto"]).astype({"Nome Projeto": str})
+        .drop_duplicates("Nome Projeto").set_index("Nome Projeto")["Time"].astype(str)
+    )
+    squad = origem("Time").fillna(projeto.map(time_por_projeto).astype("string"))
+    quantidade = pd.to_numeric(origem("Quantidade"), errors="coerce")
+    marcar(origem("Quantidade").notna() & quantidade.isna(), "Quantidade inválida")
+
+    df = pd.DataFrame({
+        "ID": [gerar_id_unico() for _ in range(len(df_origem))],
+        "Usuário": usuario,
+        "Nome": nome,
+        "Data": datas.dt.strftime("%Y-%m-%d"),
+        "Empresa": empresa,
+        "Projeto": projeto,
+        "Time": squad.fillna(""),
+        "Atividade": atividade,
+        "Quantidade": quantidade.fillna(0).round().astype("Int64"),
+        "Horas Gastas": horas,
+        "Minutos": minutos,
+        "Observações": origem("Observações").fillna("").str.replace("\n", " ").str.replace(";", ","),
+        "DataHoraLancamento": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    com_erro = problemas != ""
+    erros = df_origem[com_erro].assign(Problemas=problemas[com_erro].str.rstrip("; "))
+    # número da linha na planilha (cabeçalho = linha 1)
+    erros.insert(0, "Linha", erros.index + 2)
+    return df[~com_erro].reset_index(drop=True), erros.reset_index(drop=True)
@@ -0,0 +1,46 @@
+import warnings
+
+import pandas as pd
+
+from dados import concat_rows
+
+
+def _parte(ids, empresas):
+    return pd.DataFrame({"ID": ids, "Empresa": pd.Series(empresas, dtype="category"),
+                         "Minutos": pd.array(range(len(ids)), dtype="Int64")})
+
+
+def test_parte_unica_nao_compartilha_memoria_com_o_cache():
+    # regressão: o resultado de carregar_base era editado no lugar pelas páginas de cadastro
+    # e a edição (não salva) aparecia para todas as sessões pelo cache de leitura
+    cache = pd.DataFrame({"Codigo SAP": ["1", "2"], "Nome Empresa": ["A", "B"]})
+    for df in (concat_rows([cache]), concat_rows([cache], colunas=["Nome Empresa"]),
+               concat_rows([cache, cache.iloc[0:0]])):
+        df.loc[0, "Nome Empresa"] = "HACK"
+        df.loc[:, "Nome Empresa"] = "HACK"
+    assert cache["Nome Empresa"].tolist() == ["A", "B"]
+
+
+def test_varias_partes_nao_compartilham_memoria():
+    a, b = _parte(["1"], ["X"]), _parte(["2"], ["Y"])
+    df = concat_rows([a, b])
+    df.loc[0, "Minutos"] = 999
+    assert a["Minutos"].tolist() == [0]
+
+
+def test_une_categorias_e_mantem_o_ultimo_id():
+    df = concat_rows([_parte(["1", "2"], ["X", "Y"]), _parte(["2", "3"], ["Z", None])])
+    assert df["ID"].tolist() == ["1", "2", "3"]
+    assert df["Empresa"].tolist()[:2] == ["X", "Z"] and pd.isna(df["Empresa"].iloc[2])
+    assert isinstance(df["Empresa"].dtype, pd.CategoricalDtype)
+    assert set(df["Empresa"].cat.categories) == {"X", "Y", "Z"}
+
+
+def test_partes_vazias_nao_geram_aviso():
+    vazia = _parte([], [])
+    sem_categorias = _parte(["4"], [None])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        df = concat_rows([vazia, _parte(["1"], ["X"]), sem_categorias, vazia])
+        assert df["ID"].tolist() == ["1", "4"]
+        assert concat_rows([vazia, vazia]).empty
@@ -0,0 +1,45 @@
+from io import BytesIO
+
+import pandas as pd
+
+from dados import concat_cubos, rollup_cubo, texto_coluna
+
+DIMENSOES = ["Projeto", "Empresa"]
+
+
+def _linhas(datas, empresas, minutos):
+    return pd.DataFrame({"Data": datas, "Projeto": "P", "Empresa": empresas,
+                         "Minutos": minutos, "Quantidade": 1})
+
+
+def _cubo_salvo(df):
+    # ida e volta pelo CSV, como _save_cubo grava e _read_csv_file lê (inferência padrão)
+    buf = BytesIO()
+    rollup_cubo(df, DIMENSOES).to_csv(buf, sep=";", index=False)
+    return pd.read_csv(BytesIO(buf.getvalue()), sep=";")
+
+
+def test_cubo_salvo_e_rollup_do_journal_juntam_a_mesma_empresa():
+    salvo = _cubo_salvo(_linhas(["2024-01-02", "2024-01-03"], [1000, 2000], [60, 30]))
+    assert salvo["Empresa"].dtype.kind == "i"
+    # o journal chega tipado: Empresa como texto categórico
+    journal = _linhas(["2024-01-02"], ["1000"], [15])
+    journal["Empresa"] = texto_coluna(journal["Empresa"]).astype("category")
+    cubo = concat_cubos([salvo, rollup_cubo(journal, DIMENSOES)], DIMENSOES)
+    assert sorted(cubo["Empresa"].dropna().unique().tolist()) == ["1000", "2000"]
+    assert cubo.groupby("Empresa", observed=True)["Minutos"].sum().to_dict() == {"1000": 75, "2000": 30}
+
+
+def test_codigos_com_vazio_nao_viram_float():
+    # coluna com vazio é lida como float (1000.0): volta a "1000"
+    salvo = _cubo_salvo(_linhas(["2024-01-02", "2024-01-03"], [1000, None], [60, 30]))
+    cubo = concat_cubos([salvo], DIMENSOES)
+    assert cubo["Empresa"].cat.categories.tolist() == ["1000"]
+    assert cubo["Registros"].sum() == 2
+
+
+def test_periodo_filtra_os_dias():
+    salvo = _cubo_salvo(_linhas(["2024-01-02", "2024-02-03"], ["A", "B"], [60, 30]))
+    cubo = concat_cubos([salvo], DIMENSOES, (pd.Timestamp("2024-02-01"), pd.Timestamp("2024-02-29")))
+    assert cubo["Empresa"].tolist() == ["B"]
+    assert "Dia" not in cubo.columns
@@ -0,0 +1,94 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dados import formatar_horas, interpretar_horas, minutos_horas, minutos_validos, completar_minutos
+
+FIXOS = [
+    None, np.nan, pd.NA, "", "   ", "nan", "None", "inf", "-inf",
+    "08:00", "8:0", "23:59", "24:00", "12:60", "7;30", "7.30", "7,30", "7.75", " 1,5 ",
+    "0", "0.0", "-1", "-0.25", "-1,5", "+2.5", ".5", "5.", "1e1", "1e20", "١:٣٠",
+    "abc", "1:2:3", "::", "-", "12h", 0, 1.5, -2.25, 7, 10**13, float("nan"),
+]
+
+
+def _aleatorio(rng: random.Random):
+    tipo = rng.randrange(7)
+    if tipo == 0:
+        return f"{rng.randrange(30)}{rng.choice(':;.,')}{rng.randrange(70):0{rng.choice([1, 2])}d}"
+    if tipo == 1:
+        return f"{rng.uniform(-30, 30):.{rng.randrange(4)}f}".replace(".", rng.choice(".,"))
+    if tipo == 2:
+        return rng.choice([None, np.nan, pd.NA, ""])
+    if tipo == 3:
+        return rng.uniform(-30, 30)
+    if tipo == 4:
+        return rng.randrange(-5, 30)
+    if tipo == 5:
+        return " " * rng.randrange(2) + "".join(rng.choice("0123456789:.,;-+e xh") for _ in range(rng.randrange(1, 7)))
+    return "".join(rng.choice("abcXYZ!?") for _ in range(rng.randrange(1, 5)))
+
+
+def _amostra(seed, n=3000):
+    rng = random.Random(seed)
+    return FIXOS + [_aleatorio(rng) for _ in range(n)]
+
+
+def _esperado(valores):
+    texto = [formatar_horas(v) for v in valores]
+    minutos = [minutos_horas(v) if t is not None and len(t) < 15 else None for v, t in zip(valores, texto)]
+    return texto, minutos
+
+
+def _confere(serie, valores):
+    texto, minutos = interpretar_horas(serie)
+    esperado_texto, esperado_minutos = _esperado(valores)
+    assert texto.index.equals(serie.index) and minutos.index.equals(serie.index)
+    assert str(minutos.dtype) == "Int64"
+    assert texto.tolist() == esperado_texto
+    assert [None if pd.isna(m) else int(m) for m in minutos] == esperado_minutos
+
+
+# o comportamento de astype(str)/factorize com vazios muda entre o pandas 2 e o 3
+# (string inferida): os dois modos precisam dar o mesmo resultado
+@pytest.fixture(params=[False, True], ids=["object", "infer_string"])
+def modo_string(request):
+    with pd.option_context("future.infer_string", request.param):
+        yield
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_interpretar_horas_equivale_a_formatar_horas(modo_string, seed):
+    valores = _amostra(seed)
+    _confere(pd.Series(valores, dtype=object, index=range(100, 100 + len(valores))), valores)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_interpretar_horas_em_colunas_de_texto(modo_string, seed):
+    # como a coluna chega do CSV (string/categoria, vazios como NaN)
+    valores = [None if pd.isna(v) else str(v) for v in _amostra(seed)]
+    for dtype in ("string", "category"):
+        _confere(pd.Series(valores, dtype=dtype), [None if v is None else v for v in valores])
+
+
+def test_interpretar_horas_serie_vazia_e_so_vazios(modo_string):
+    _confere(pd.Series([], dtype=object), [])
+    _confere(pd.Series([None, np.nan, None], dtype=object), [None, np.nan, None])
+
+
+def test_completar_minutos_so_preenche_o_que_falta(modo_string):
+    df = pd.DataFrame({"Horas Gastas": ["1,75", "08:00", None, "x"], "Minutos": [None, 999, None, None]})
+    completar_minutos(df)
+    assert df["Minutos"].tolist()[:2] == [105, 999]
+    assert df["Minutos"].isna().tolist() == [False, False, True, True]
+    assert df["Horas Gastas"].tolist()[:2] == ["01:45", "08:00"]
+
+
+def test_minutos_validos_de_um_minuto_a_24_horas(modo_string):
+    # a grade semanal e a importação aceitam texto livre: "-2" e "99" viram -02:00 e 99:00
+    valores = ["00:01", "24", "00:00", "-2", "99", "25:00", "abc", None]
+    _, minutos = interpretar_horas(pd.Series(valores, dtype=object))
+    assert minutos_validos(minutos).tolist() == [True, True, False, False, False, False, False, False]
+    assert [minutos_validos(minutos_horas(v)) for v in valores] == minutos_validos(minutos).tolist()
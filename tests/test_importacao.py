@@ -0,0 +1,31 @@
+import pandas as pd
+
+from dados import validar_importacao_timesheet
+
+USUARIOS = {"ana": {"name": "Ana"}}
+EMPRESAS = pd.DataFrame({"Codigo SAP": [1000]})
+PROJETOS = pd.DataFrame({"Nome Projeto": ["P"], "Time": ["T"]})
+ATIVIDADES = pd.DataFrame({"Projeto Vinculado": ["P"], "Nome Atividade": ["A"]})
+MAPA = {c: c for c in ["Usuário", "Data", "Empresa", "Projeto", "Atividade", "Horas Gastas"]}
+
+
+def _validar(horas):
+    origem = pd.DataFrame({"Usuário": "ana", "Data": "2024-02-05", "Empresa": 1000, "Projeto": "P",
+                           "Atividade": "A", "Horas Gastas": horas})
+    return validar_importacao_timesheet(origem, MAPA, USUARIOS, EMPRESAS, PROJETOS, ATIVIDADES)
+
+
+def test_horas_fora_de_um_minuto_a_24_horas_sao_erro():
+    # "25:00" não é um horário (inválida); "25" em horas decimais passaria de 24 horas
+    validas, erros = _validar(["01:30", "-2", "25", "25:00", "00:00", "24", "xx"])
+    assert validas["Minutos"].tolist() == [90, 1440]
+    assert erros["Linha"].tolist() == [3, 4, 5, 6, 8]
+    fora, invalida = "Horas fora de 1 minuto a 24 horas", "Horas inválidas"
+    assert erros["Problemas"].tolist() == [fora, fora, invalida, fora, invalida]
+
+
+def test_linha_valida_no_formato_da_base():
+    validas, erros = _validar(["8,75"])
+    assert erros.empty
+    linha = validas.iloc[0]
+    assert (linha["Nome"], linha["Empresa"], linha["Time"], linha["Horas Gastas"]) == ("Ana", "1000", "T", "08:45")
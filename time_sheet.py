@@ -1,19 +1,39 @@
 import streamlit as st
 import pandas as pd
-import tempfile
-from datetime import datetime, date, time as dt_time
+import numpy as np
+from datetime import datetime, date, timedelta, time as dt_time
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
+from pydrive2.files import GoogleDriveFile
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 from oauth2client.client import OAuth2Credentials
 import httplib2
 from openai import OpenAI
 from io import BytesIO
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from concurrent.futures import ThreadPoolExecutor, Future
 from docx import Document
 from docx.shared import Pt
 import plotly.express as px
 import re
+import os
+import posixpath
+import json
 import uuid
+import gzip
 import time
+import random
+import threading
+import queue
+import atexit
+import logging
+from functools import wraps
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dados import (formatar_horas, interpretar_horas, minutos_horas, completar_minutos, minutos_validos,
+                   concat_rows, texto_coluna, rollup_cubo, concat_cubos, gerar_id_unico,
+                   validar_importacao_timesheet)
 
 # =============================================
 # CONFIGURAÇÕES GERAIS
@@ -21,12 +41,15 @@ import time
 st.set_page_config(page_title="Timesheet Fiscal", layout="wide")
 st.sidebar.markdown(f"📅 Hoje é: **{date.today().strftime('%d/%m/%Y')}**")
 
+# falhas de derivados (snapshot, cubo) não interrompem a gravação: vão para o log do servidor
+log = logging.getLogger("timesheet")
+
 CSV_SEP = ";"
 CSV_ENC = "utf-8-sig"
 BASES = {
     "timesheet.csv": [
         "ID", "Usuário", "Nome", "Data", "Empresa", "Projeto", "Time",
-        "Atividade", "Quantidade", "Horas Gastas", "Observações",
+        "Atividade", "Quantidade", "Horas Gastas", "Minutos", "Observações",
         "DataHoraLancamento"
     ],
     "empresas.csv": ["Codigo SAP", "Nome Empresa", "Descrição"],
@@ -34,6 +57,92 @@ BASES = {
     "atividades.csv": ["Nome Atividade", "Projeto Vinculado", "Descrição", "Status"],
 }
 
+# Colunas de baixa cardinalidade do timesheet, carregadas como categóricas
+COLUNAS_CATEGORICAS_TS = ["Usuário", "Nome", "Empresa", "Projeto", "Time", "Atividade", "Horas Gastas"]
+
+# Cubo do Dashboard: minutos, quantidade e registros somados por dia × dimensões, gravado
+# ao lado de cada CSV (base ou partição) a cada escrita; o Dashboard lê só os cubos
+CUBO_BASES = {"timesheet.csv"}
+CUBO_DIMENSOES = ["Projeto", "Time", "Atividade", "Empresa", "Usuário", "Nome"]
+CUBO_EXT = ".cubo.csv.gz"
+
+# Resultados do Dashboard (KPIs e gráficos) memorizados por versão da base, período e
+# filtros; LRU compartilhado entre as sessões
+DASHBOARD_CACHE_MAX = 64
+
+# Snapshot colunar (Parquet) gravado ao lado de cada CSV; o CSV segue como export editável
+SNAPSHOT_EXT = ".parquet"
+try:
+    import pyarrow  # noqa: F401 — engine do Parquet no pandas
+    PARQUET_DISPONIVEL = True
+except ImportError:
+    PARQUET_DISPONIVEL = False
+
+# Agregações do dashboard numa consulta DuckDB; sem o pacote, cai no pandas
+try:
+    import duckdb
+    DUCKDB_DISPONIVEL = True
+except ImportError:
+    DUCKDB_DISPONIVEL = False
+
+# Journal: cada envio vira um delta em ts-fiscal/journal_<base>; a compactação
+# incorpora os deltas na base ao passar de N entradas ou da idade máxima
+JOURNAL_BASES = {"timesheet.csv"}
+JOURNAL_MAX_ENTRADAS = 50
+JOURNAL_MAX_IDADE_SEG = 30 * 60
+
+# Objetos internos (backups e deltas do journal) trafegam comprimidos; as bases e o
+# snapshot não, para o CSV continuar editável no Drive. A leitura detecta o gzip sozinha.
+GZIP_OBJETOS_INTERNOS = True
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Bases particionadas pelo mês de Data: ts-fiscal/<base>/AAAA-MM.csv
+PARTICIONADAS = {"timesheet.csv"}
+PARTICAO_SEM_DATA = "sem-data"
+# gravado na pasta das partições só depois da migração da base monolítica terminar
+PARTICAO_MARCADOR = "migracao_concluida.json"
+
+# Backups: cada escrita grava só as linhas alteradas (delta) em Backup_<base>;
+# a cada N deltas grava uma cópia completa (checkpoint) para limitar o replay
+BACKUP_CHECKPOINT_A_CADA = 50
+
+# Locks com lease: o arquivo do lock vale LOCK_LEASE_SEG; disputa com backoff exponencial + jitter
+LOCK_LEASE_SEG = 120
+LOCK_BACKOFF_INICIAL_SEG = 0.2
+LOCK_BACKOFF_MAX_SEG = 2.0
+
+# Escritas otimistas: grava condicionada à versão lida e reaplica em conflito;
+# depois de N conflitos seguidos, repete com os locks
+ESCRITA_OTIMISTA = True
+ESCRITA_OTIMISTA_TENTATIVAS = 3
+
+# Fila de gravação dos lançamentos: junta os envios de uma janela curta num lote só
+FILA_JANELA_SEG = 0.5
+FILA_TENTATIVAS = 3
+FILA_ESPERA_ACK_SEG = 10
+
+# Importação em lote: bases não particionadas são gravadas em lotes deste tamanho
+IMPORTACAO_LOTE_LINHAS = 5000
+
+# Fila de backups (fora do caminho da escrita): tamanho máximo, espera do escritor com a fila
+# cheia, tentativas por job, falhas mantidas para consulta e tempo de descarga no encerramento
+BACKUP_FILA_MAX = 500
+BACKUP_FILA_ESPERA_SEG = 30
+BACKUP_TENTATIVAS = 4
+BACKUP_FALHAS_MAX = 50
+BACKUP_FLUSH_SEG = 60
+
+# Cliente do Drive: timeout por chamada, tentativas com backoff exponencial para 429/5xx e
+# falhas de rede, renovação do token antes de expirar e circuito que, após N falhas
+# seguidas, para de chamar o Drive por alguns segundos (leituras usam a última cópia em cache)
+DRIVE_TIMEOUT_SEG = 30
+DRIVE_TENTATIVAS = 4
+DRIVE_BACKOFF_INICIAL_SEG = 0.5
+DRIVE_BACKOFF_MAX_SEG = 8.0
+DRIVE_TOKEN_MARGEM_SEG = 300
+DRIVE_CIRCUITO_FALHAS = 5
+DRIVE_CIRCUITO_ABERTO_SEG = 30
+
 ADMIN_USERS = ["cvieira", "wreis", "waraujo", "iassis"]
 
 # =============================================
@@ -81,7 +190,7 @@ if st.sidebar.button("Logout"):
     st.rerun()
 
 # =============================================
-# GOOGLE DRIVE (PyDrive2) + UTILITÁRIOS
+# ARMAZENAMENTO (Google Drive ou local) + UTILITÁRIOS
 # =============================================
 
 def _build_credentials_from_secrets():
@@ -96,13 +205,14 @@ def _build_credentials_from_secrets():
         user_agent="streamlit-app/1.0",
         revoke_uri=cred_dict.get("revoke_uri")
     )
-    http = httplib2.Http()
+    http = httplib2.Http(timeout=DRIVE_TIMEOUT_SEG)
     credentials.refresh(http)
     return credentials
 
 @st.cache_resource(show_spinner=False)
 def conectar_drive():
-    gauth = GoogleAuth()
+    # http_timeout vale para os objetos http que o PyDrive2 cria por thread
+    gauth = GoogleAuth(http_timeout=DRIVE_TIMEOUT_SEG)
     gauth.credentials = _build_credentials_from_secrets()
     drive = GoogleDrive(gauth)
     return drive
@@ -110,259 +220,2259 @@ def conectar_drive():
 @st.cache_resource(show_spinner=False)
 def obter_pasta_ts_fiscal_id():
     drive = conectar_drive()
-    lista = drive.ListFile({
+    lista = _chamar_drive(lambda: drive.ListFile({
         'q': "title='ts-fiscal' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    }).GetList()
+    }).GetList())
     if lista:
         return lista[0]['id']
     pasta = drive.CreateFile({
         'title': 'ts-fiscal',
         'mimeType': 'application/vnd.google-apps.folder'
     })
-    pasta.Upload()
+    _chamar_drive(pasta.Upload, idempotente=False)
     return pasta['id']
 
-# ---------- Locks ----------
+# ---------- Cliente do Drive resiliente ----------
 
-def _locks_folder_id(drive, root_id):
-    lista = drive.ListFile({'q': f"'{root_id}' in parents and title='locks' and mimeType='application/vnd.google-apps.folder' and trashed=false"}).GetList()
-    if lista:
-        return lista[0]['id']
-    p = drive.CreateFile({'title': 'locks', 'mimeType': 'application/vnd.google-apps.folder', 'parents': [{'id': root_id}]})
-    p.Upload()
-    return p['id']
-
-class DriveLock:
-    def __init__(self, base_name: str, timeout_sec: int = 8):
-        self.drive = conectar_drive()
-        self.root_id = obter_pasta_ts_fiscal_id()
-        self.locks_id = _locks_folder_id(self.drive, self.root_id)
+class DriveIndisponivel(Exception):
+    # tentativas esgotadas em erro transitório, ou circuito aberto
+    pass
+
+
+@st.cache_resource(show_spinner=False)
+def _circuito_drive():
+    # fechado enquanto falhas < DRIVE_CIRCUITO_FALHAS; aberto, recusa as chamadas até
+    # "aberto_ate"; depois deixa passar uma chamada de teste, que fecha ou reabre o circuito
+    return {"lock": threading.Lock(), "token_lock": threading.Lock(), "falhas": 0, "aberto_ate": 0.0, "testando": False}
+
+
+def estado_circuito_drive():
+    circuito = _circuito_drive()
+    with circuito["lock"]:
+        if circuito["falhas"] < DRIVE_CIRCUITO_FALHAS:
+            return "fechado"
+        return "aberto" if time.time() < circuito["aberto_ate"] else "meio aberto"
+
+
+def _liberar_chamada_drive():
+    circuito = _circuito_drive()
+    with circuito["lock"]:
+        if circuito["falhas"] < DRIVE_CIRCUITO_FALHAS:
+            return
+        if time.time() < circuito["aberto_ate"] or circuito["testando"]:
+            raise DriveIndisponivel("Google Drive indisponível (circuito aberto)")
+        circuito["testando"] = True
+
+
+def _registrar_resultado_drive(ok: bool):
+    circuito = _circuito_drive()
+    with circuito["lock"]:
+        circuito["testando"] = False
+        if ok:
+            circuito["falhas"] = 0
+            return
+        circuito["falhas"] += 1
+        if circuito["falhas"] >= DRIVE_CIRCUITO_FALHAS:
+            circuito["aberto_ate"] = time.time() + DRIVE_CIRCUITO_ABERTO_SEG
+
+
+def _renovar_token_drive():
+    # renova antes de expirar, para nenhuma chamada pagar o 401 + refresh no meio da página
+    credenciais = conectar_drive().auth.credentials
+    margem = timedelta(seconds=DRIVE_TOKEN_MARGEM_SEG)
+    if credenciais.token_expiry is None or credenciais.token_expiry - datetime.utcnow() > margem:
+        return
+    with _circuito_drive()["token_lock"]:
+        if credenciais.token_expiry - datetime.utcnow() <= margem:
+            credenciais.refresh(httplib2.Http(timeout=DRIVE_TIMEOUT_SEG))
+
+
+def _http_erro(e: Exception):
+    # o PyDrive2 embrulha o HttpError da API em ApiRequestError(http_error)
+    return e if isinstance(e, HttpError) else next((a for a in e.args if isinstance(a, HttpError)), None)
+
+
+def _motivos_erro_drive(http_erro):
+    # reasons de error.errors[] no corpo JSON da resposta (rateLimitExceeded, notFound...)
+    try:
+        erros = json.loads(http_erro.content or b'{}')['error']['errors']
+        return {str(item.get('reason')) for item in erros}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def _classificar_erro_drive(e: Exception):
+    # devolve (tipo, espera): "limite" = o Drive recusou sem executar (429, 403 de cota), pode
+    # repetir sempre; "transitorio" = 5xx ou rede, só repete o que é idempotente; None = definitivo
+    http_erro = _http_erro(e)
+    if http_erro is not None:
+        status = http_erro.resp.status
+        espera = http_erro.resp.get('retry-after')
+        espera = min(float(espera), DRIVE_BACKOFF_MAX_SEG) if espera and str(espera).isdigit() else None
+        if status == 429 or (status == 403 and _motivos_erro_drive(http_erro) & {'rateLimitExceeded', 'userRateLimitExceeded'}):
+            return "limite", espera
+        if status >= 500:
+            return "transitorio", espera
+        return None, None
+    if isinstance(e, (OSError, httplib2.HttpLib2Error)):
+        return "transitorio", None
+    return None, None
+
+
+def _chamar_drive(chamada, idempotente: bool = True):
+    # criações não são idempotentes: depois de um timeout o arquivo pode já existir
+    _liberar_chamada_drive()
+    for tentativa in range(DRIVE_TENTATIVAS):
+        try:
+            _renovar_token_drive()
+            resultado = chamada()
+        except Exception as e:
+            tipo, espera = _classificar_erro_drive(e)
+            if tipo is None:
+                # o Drive respondeu (404, 412, permissão...): não é falha de disponibilidade
+                _registrar_resultado_drive(True)
+                raise
+            if (tipo == "transitorio" and not idempotente) or tentativa == DRIVE_TENTATIVAS - 1:
+                _registrar_resultado_drive(False)
+                raise DriveIndisponivel(f"Google Drive indisponível: {e}") from e
+            time.sleep(espera or random.uniform(0, min(DRIVE_BACKOFF_MAX_SEG, DRIVE_BACKOFF_INICIAL_SEG * 2 ** tentativa)))
+            continue
+        _registrar_resultado_drive(True)
+        return resultado
+
+# ---------- Contagem de chamadas ao armazenamento ----------
+
+_contador_drive = threading.local()
+
+
+@st.cache_resource(show_spinner=False)
+def _estatisticas_drive():
+    # operação -> {"execucoes", "chamadas", "ultima"}
+    return {"lock": threading.Lock(), "operacoes": {}}
+
+
+def _contar_chamada_drive(n: int = 1):
+    if getattr(_contador_drive, "n", None) is not None:
+        _contador_drive.n += n
+
+
+def _medir_chamadas(operacao: str):
+    # conta as chamadas ao Drive feitas dentro da operação (inclusive as aninhadas)
+    def decorador(func):
+        @wraps(func)
+        def _envolvida(*args, **kwargs):
+            anterior = getattr(_contador_drive, "n", None)
+            _contador_drive.n = 0
+            try:
+                return func(*args, **kwargs)
+            finally:
+                n = _contador_drive.n
+                _contador_drive.n = anterior + n if anterior is not None else None
+                stats = _estatisticas_drive()
+                with stats["lock"]:
+                    op = stats["operacoes"].setdefault(operacao, {"execucoes": 0, "chamadas": 0, "ultima": 0})
+                    op["execucoes"] += 1
+                    op["chamadas"] += n
+                    op["ultima"] = n
+        return _envolvida
+    return decorador
+
+
+def estatisticas_drive_df():
+    stats = _estatisticas_drive()
+    with stats["lock"]:
+        linhas = [
+            {"Operação": nome, "Execuções": op["execucoes"], "Última": op["ultima"],
+             "Média": round(op["chamadas"] / op["execucoes"], 1) if op["execucoes"] else 0}
+            for nome, op in sorted(stats["operacoes"].items())
+        ]
+    return pd.DataFrame(linhas, columns=["Operação", "Execuções", "Última", "Média"])
+
+# ---------- Backends de armazenamento ----------
+
+PASTA_MIME = 'application/vnd.google-apps.folder'
+
+
+class ConflitoVersao(Exception):
+    # gravação condicional recusada: o objeto mudou desde a leitura
+    pass
+
+
+@st.cache_resource(show_spinner=False)
+def _storage_config():
+    # [storage] no secrets.toml; TS_STORAGE_BACKEND / TS_STORAGE_PATH no ambiente têm precedência
+    try:
+        cfg = dict(st.secrets.get("storage", {}))
+    except Exception:
+        cfg = {}
+    return {
+        "backend": str(os.environ.get("TS_STORAGE_BACKEND", cfg.get("backend", "drive"))).lower(),
+        "path": os.environ.get("TS_STORAGE_PATH", cfg.get("path", "dados_ts_fiscal")),
+    }
+
+
+class StorageBackend(ABC):
+    # Objetos são dicts de metadados no formato do Drive v2:
+    # id, title, parents=[{'id': pasta}], mimeType, modifiedDate, version e description (opcional)
+
+    @abstractmethod
+    def root_id(self):
+        ...
+
+    @abstractmethod
+    def list(self, folder_id: str):
+        ...
+
+    @abstractmethod
+    def folder(self, name: str, parent_id: str):
+        ...
+
+    @abstractmethod
+    def read(self, meta: dict):
+        ...
+
+    @abstractmethod
+    def write(self, meta: dict, data: bytes | None = None, mimetype: str = "text/csv", condicional: bool = False):
+        # sem 'id' cria o objeto; com 'id' atualiza conteúdo e/ou title/description.
+        # condicional=True só grava se o objeto ainda estiver na versão de `meta` (senão ConflitoVersao)
+        ...
+
+    @abstractmethod
+    def delete(self, meta: dict):
+        ...
+
+    def lock(self, base_name: str, timeout_sec: int = 8, owner: str | None = None):
+        return LeaseLock(self, base_name, timeout_sec, owner)
+
+    def backup(self, data: bytes, base_title: str, revision: str | None, particao: str | None = None,
+               tipo: str = "checkpoint", ts: datetime | None = None):
+        # tipo: checkpoint (cópia completa) ou a operação de um delta (insert/update/delete);
+        # ts: momento da escrita na base (o upload pode acontecer depois, na fila de backups)
+        ts = (ts or datetime.now()).strftime('%Y%m%d_%H%M%S_%f')
+        rev = f"rev-{revision}" if revision else "rev-unknown"
+        data, fname = _maybe_gzip(data, f"{_backup_nome(base_title, particao)}__{ts}__{tipo}__{rev}.csv")
+        _upload_bytes({'title': fname, 'parents': [{'id': _backup_folder_id(base_title)}]}, data,
+                      "application/gzip" if fname.endswith(".gz") else "text/csv")
+
+
+@st.cache_resource(show_spinner=False)
+def _estatisticas_locks():
+    # base -> {"aquisicoes", "timeouts", "tentativas", "tomadas", "espera_total", "espera_max", "posse_total", "posse_max"}
+    return {"lock": threading.Lock(), "bases": {}}
+
+
+def _registrar_lock(base_name: str, **valores):
+    # locks de partição (<base>@AAAA-MM) somam na base
+    stats = _estatisticas_locks()
+    with stats["lock"]:
+        b = stats["bases"].setdefault(base_name.split('@')[0], {
+            "aquisicoes": 0, "timeouts": 0, "tentativas": 0, "tomadas": 0,
+            "espera_total": 0.0, "espera_max": 0.0, "posse_total": 0.0, "posse_max": 0.0,
+        })
+        for campo, valor in valores.items():
+            b[campo] = max(b[campo], valor) if campo.endswith("_max") else b[campo] + valor
+
+
+def estatisticas_locks_df():
+    stats = _estatisticas_locks()
+    with stats["lock"]:
+        linhas = [
+            {"Base": nome, "Aquisições": b["aquisicoes"], "Timeouts": b["timeouts"], "Leases vencidos": b["tomadas"],
+             "Tentativas": b["tentativas"],
+             "Espera média (s)": round(b["espera_total"] / max(b["aquisicoes"] + b["timeouts"], 1), 2),
+             "Espera máx (s)": round(b["espera_max"], 2),
+             "Posse média (s)": round(b["posse_total"] / max(b["aquisicoes"], 1), 2),
+             "Posse máx (s)": round(b["posse_max"], 2)}
+            for nome, b in sorted(stats["bases"].items())
+        ]
+    return pd.DataFrame(linhas, columns=["Base", "Aquisições", "Timeouts", "Leases vencidos", "Tentativas",
+                                         "Espera média (s)", "Espera máx (s)", "Posse média (s)", "Posse máx (s)"])
+
+
+class LeaseLock:
+    # Cada disputante grava o próprio <base>.lock.<uuid> com a validade do lease no description
+    # e relista a pasta: fica com o lock só quem for o único lease válido; os demais apagam o seu
+    # e tentam de novo com backoff exponencial + jitter. Lease vencido (sessão que caiu com o
+    # lock) é apagado por quem o encontrar; o dono antigo só apaga o próprio arquivo no release.
+
+    def __init__(self, backend, base_name: str, timeout_sec: int = 8, owner: str | None = None,
+                 lease_sec: int = LOCK_LEASE_SEG):
+        self.backend = backend
+        self.locks_id = _locks_folder_id(backend.root_id())
         self.base_name = base_name
         self.lock_title = f"{base_name}.lock"
         self.timeout_sec = timeout_sec
-        self.file = None
+        self.lease_sec = lease_sec
+        # threads de fundo não têm session_state: recebem o dono explicitamente
+        self.owner = owner or st.session_state.username
+        self.meta = None
+        self.adquirido_em = None
+
+    def _validade(self, meta: dict):
+        try:
+            return float(json.loads(meta.get('description') or '{}')['expira'])
+        except (ValueError, KeyError, TypeError):
+            pass
+        # lock do formato antigo, sem lease: vale LOCK_LEASE_SEG a partir da gravação
+        try:
+            gravado = datetime.fromisoformat(meta.get('modifiedDate', '').replace('Z', '+00:00'))
+        except ValueError:
+            return 0.0
+        return gravado.timestamp() + LOCK_LEASE_SEG
+
+    def _leases(self):
+        # o lock precisa ser consultado ao vivo (não passa pelo índice)
+        return [m for m in self.backend.list(self.locks_id)
+                if m['title'] == self.lock_title or m['title'].startswith(f"{self.lock_title}.")]
+
+    def _gravar(self):
+        agora = datetime.now()
+        info = {'owner': self.owner, 'ts': agora.isoformat(), 'expira': time.time() + self.lease_sec}
+        meta = {'title': f"{self.lock_title}.{uuid.uuid4().hex}", 'parents': [{'id': self.locks_id}],
+                'description': json.dumps(info)}
+        try:
+            return self.backend.write(meta, f"locked-by={self.owner}; ts={agora.isoformat()}".encode("utf-8"), "text/plain")
+        except Exception:
+            return None
+
+    def _apagar(self, meta: dict):
+        try:
+            self.backend.delete(meta)
+            return True
+        except Exception:
+            return False
 
     def acquire(self):
-        start = time.time()
+        inicio = time.time()
+        tentativas = tomadas = 0
         while True:
-            existing = self.drive.ListFile({'q': f"'{self.locks_id}' in parents and title='{self.lock_title}' and trashed=false"}).GetList()
-            if not existing:
-                # create
-                f = self.drive.CreateFile({'title': self.lock_title, 'parents': [{'id': self.locks_id}]})
-                f.SetContentString(f"locked-by={st.session_state.username}; ts={datetime.now().isoformat()}")
-                try:
-                    f.Upload()
-                    self.file = f
-                    return True
-                except Exception:
-                    pass
-            if time.time() - start > self.timeout_sec:
+            tentativas += 1
+            validos = []
+            for m in self._leases():
+                if self._validade(m) < time.time():
+                    tomadas += self._apagar(m)
+                else:
+                    validos.append(m)
+            if not validos:
+                meta = self._gravar()
+                if meta is not None:
+                    outros = [m for m in self._leases() if m['id'] != meta['id'] and self._validade(m) >= time.time()]
+                    if not outros:
+                        self.meta = meta
+                        self.adquirido_em = time.time()
+                        espera = self.adquirido_em - inicio
+                        _registrar_lock(self.base_name, aquisicoes=1, tentativas=tentativas, tomadas=tomadas,
+                                        espera_total=espera, espera_max=espera)
+                        return True
+                    # disputa simultânea: todos recuam e o jitter desempata
+                    self._apagar(meta)
+            espera = time.time() - inicio
+            if espera > self.timeout_sec:
+                _registrar_lock(self.base_name, timeouts=1, tentativas=tentativas, tomadas=tomadas,
+                                espera_total=espera, espera_max=espera)
                 return False
-            time.sleep(0.4)
+            teto = min(LOCK_BACKOFF_MAX_SEG, LOCK_BACKOFF_INICIAL_SEG * 2 ** (tentativas - 1))
+            time.sleep(min(teto / 2 + random.uniform(0, teto / 2), self.timeout_sec - espera + 0.05))
 
-    def release(self):
+    def renovar(self):
+        # estende o lease de quem segura o lock por uma operação longa; False se o lease já
+        # venceu e foi apagado (ou tomado) por outro processo: quem chamou deve abortar
+        if self.meta is None:
+            return False
+        leases = self._leases()
+        if not any(m['id'] == self.meta['id'] for m in leases):
+            return False
+        if any(m['id'] != self.meta['id'] and self._validade(m) >= time.time() for m in leases):
+            return False
+        agora = datetime.now()
+        info = {'owner': self.owner, 'ts': agora.isoformat(), 'expira': time.time() + self.lease_sec}
         try:
-            if self.file is not None:
-                self.file.Delete()
+            self.meta = {**self.meta, **self.backend.write({'id': self.meta['id'], 'description': json.dumps(info)})}
+            return True
         except Exception:
-            pass
+            return False
+
+    def release(self):
+        if self.meta is None:
+            return
+        self._apagar(self.meta)
+        posse = time.time() - self.adquirido_em
+        _registrar_lock(self.base_name, posse_total=posse, posse_max=posse)
+        self.meta = None
+
+
+class DriveBackend(StorageBackend):
+    def root_id(self):
+        return obter_pasta_ts_fiscal_id()
+
+    def list(self, folder_id: str):
+        files = _chamar_drive(conectar_drive().ListFile({'q': f"'{folder_id}' in parents and trashed=false"}).GetList)
+        _contar_chamada_drive()
+        return [dict(f) for f in files]
+
+    def folder(self, name: str, parent_id: str):
+        p = conectar_drive().CreateFile({'title': name, 'mimeType': PASTA_MIME, 'parents': [{'id': parent_id}]})
+        _chamar_drive(p.Upload, idempotente=False)
+        _contar_chamada_drive()
+        return dict(p)
+
+    def _file(self, meta: dict):
+        # uploaded=True: o objeto já tem os metadados, não precisa de FetchMetadata
+        return GoogleDriveFile(auth=conectar_drive().auth, metadata=dict(meta), uploaded=True)
+
+    def read(self, meta: dict):
+        f = self._file(meta)
+        _chamar_drive(f.FetchContent)
+        _contar_chamada_drive()
+        return f.content.getvalue()
+
+    def _write_condicional(self, meta: dict, data: bytes | None, mimetype: str):
+        # files.update com If-Match no etag lido: o Drive responde 412 se houve outra gravação
+        drive = conectar_drive()
+        corpo = {k: meta[k] for k in ('title', 'description') if meta.get(k) is not None}
+        media = MediaIoBaseUpload(BytesIO(data), mimetype=mimetype) if data is not None else None
+        req = drive.auth.service.files().update(fileId=meta['id'], body=corpo, media_body=media)
+        req.headers['If-Match'] = meta['etag']
+        try:
+            return _chamar_drive(lambda: req.execute(http=drive.auth.Get_Http_Object()))
+        except HttpError as e:
+            if e.resp.status == 412:
+                raise ConflitoVersao(meta.get('title', meta['id']))
+            raise
+        finally:
+            _contar_chamada_drive()
+
+    def write(self, meta: dict, data: bytes | None = None, mimetype: str = "text/csv", condicional: bool = False):
+        if condicional and meta.get('id') and meta.get('etag'):
+            return self._write_condicional(meta, data, mimetype)
+        if meta.get('id'):
+            # parte só do id: title/description informados entram como alterações no upload
+            f = self._file({'id': meta['id']})
+            for campo in ('title', 'description'):
+                if meta.get(campo) is not None:
+                    f[campo] = meta[campo]
+        else:
+            f = conectar_drive().CreateFile({k: v for k, v in meta.items() if k in ('title', 'parents', 'description', 'mimeType')})
+            if f.get('mimeType') is None:
+                f['mimeType'] = mimetype
+        def _enviar():
+            # a cada tentativa o conteúdo é reenviado desde o início
+            if data is not None:
+                f.content = BytesIO(data)
+            f.Upload()
+
+        # com id é update (repetir grava o mesmo conteúdo); sem id é criação
+        _chamar_drive(_enviar, idempotente=bool(meta.get('id')))
+        _contar_chamada_drive()
+        return dict(f)
+
+    def delete(self, meta: dict):
+        f = self._file({'id': meta['id']})
+        try:
+            _chamar_drive(f.Delete)
+        except Exception as e:
+            # 404: já removido (por outro processo ou por uma tentativa anterior que expirou)
+            if _http_erro(e) is None or _http_erro(e).resp.status != 404:
+                raise
+        _contar_chamada_drive()
+
+
+@st.cache_resource(show_spinner=False)
+def _escrita_local_lock():
+    return threading.Lock()
+
+
+class LocalBackend(StorageBackend):
+    # espelha a estrutura do ts-fiscal em disco; ids são caminhos relativos a `path`
+    # e o description fica num arquivo oculto ao lado (.<title>.descricao)
+
+    def __init__(self, path: str):
+        self.base = os.path.abspath(path)
+
+    def _abs(self, rel: str):
+        return os.path.join(self.base, *rel.split('/'))
+
+    def _desc_path(self, rel: str):
+        pasta, nome = posixpath.split(rel)
+        return self._abs(posixpath.join(pasta, f".{nome}.descricao"))
+
+    def _meta(self, rel: str):
+        caminho = self._abs(rel)
+        info = os.stat(caminho)
+        meta = {
+            'id': rel,
+            'title': posixpath.basename(rel),
+            'parents': [{'id': posixpath.dirname(rel)}],
+            'mimeType': PASTA_MIME if os.path.isdir(caminho) else 'application/octet-stream',
+            'modifiedDate': datetime.fromtimestamp(info.st_mtime).isoformat(),
+            'version': f"{info.st_mtime_ns}-{info.st_size}",
+        }
+        if os.path.exists(self._desc_path(rel)):
+            with open(self._desc_path(rel), encoding="utf-8") as fh:
+                meta['description'] = fh.read()
+        return meta
+
+    def _write_atomic(self, caminho: str, data: bytes):
+        pasta, nome = os.path.split(caminho)
+        tmp = os.path.join(pasta, f".{nome}.{uuid.uuid4().hex}.tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, caminho)
+
+    def root_id(self):
+        os.makedirs(self._abs("ts-fiscal"), exist_ok=True)
+        return "ts-fiscal"
+
+    def list(self, folder_id: str):
+        _contar_chamada_drive()
+        pasta = self._abs(folder_id)
+        if not os.path.isdir(pasta):
+            return []
+        return [self._meta(posixpath.join(folder_id, nome)) for nome in sorted(os.listdir(pasta)) if not nome.startswith('.')]
+
+    def folder(self, name: str, parent_id: str):
+        _contar_chamada_drive()
+        rel = posixpath.join(parent_id, name)
+        os.makedirs(self._abs(rel), exist_ok=True)
+        return self._meta(rel)
+
+    def read(self, meta: dict):
+        _contar_chamada_drive()
+        with open(self._abs(meta['id']), "rb") as fh:
+            return fh.read()
+
+    def write(self, meta: dict, data: bytes | None = None, mimetype: str = "text/csv", condicional: bool = False):
+        _contar_chamada_drive()
+        if condicional and meta.get('id'):
+            # o teste-e-grava só é atômico dentro do processo (backend de teste/benchmark)
+            with _escrita_local_lock():
+                if os.path.exists(self._abs(meta['id'])) and self._meta(meta['id'])['version'] != meta.get('version'):
+                    raise ConflitoVersao(meta['id'])
+                return self._write(meta, data)
+        return self._write(meta, data)
+
+    def _write(self, meta: dict, data: bytes | None):
+        if meta.get('id'):
+            rel = meta['id']
+            novo_rel = posixpath.join(posixpath.dirname(rel), meta.get('title') or posixpath.basename(rel))
+            if novo_rel != rel:
+                os.replace(self._abs(rel), self._abs(novo_rel))
+                if os.path.exists(self._desc_path(rel)):
+                    os.replace(self._desc_path(rel), self._desc_path(novo_rel))
+                rel = novo_rel
+        else:
+            rel = posixpath.join(meta['parents'][0]['id'], meta['title'])
+            os.makedirs(os.path.dirname(self._abs(rel)), exist_ok=True)
+        if data is not None:
+            self._write_atomic(self._abs(rel), data)
+        if meta.get('description') is not None:
+            self._write_atomic(self._desc_path(rel), meta['description'].encode("utf-8"))
+        return self._meta(rel)
+
+    def delete(self, meta: dict):
+        _contar_chamada_drive()
+        for caminho in (self._abs(meta['id']), self._desc_path(meta['id'])):
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+
+def obter_backend():
+    cfg = _storage_config()
+    if cfg["backend"] == "local":
+        return LocalBackend(cfg["path"])
+    return DriveBackend()
+
+
+def criar_lock(base_name: str, timeout_sec: int = 8, owner: str | None = None):
+    return obter_backend().lock(base_name, timeout_sec, owner)
+
+# ---------- Índice de pastas ----------
+
+@st.cache_resource(show_spinner=False)
+def _folder_index():
+    # pasta_id -> {title: [metadados]}: uma listagem resolve todos os filhos da pasta
+    # (bases, locks, Backup_*, journal, partições); só é refeita quando uma busca falha
+    # ou quando a leitura precisa de version/modifiedDate atualizados
+    return {"lock": threading.Lock(), "pastas": {}}
+
+
+def _list_folder(pasta_id: str):
+    filhos = {}
+    for meta in obter_backend().list(pasta_id):
+        filhos.setdefault(meta['title'], []).append(meta)
+    indice = _folder_index()
+    with indice["lock"]:
+        indice["pastas"][pasta_id] = filhos
+    return filhos
+
+
+def _folder_children(pasta_id: str, fresco: bool = False):
+    if not fresco:
+        indice = _folder_index()
+        with indice["lock"]:
+            filhos = indice["pastas"].get(pasta_id)
+        if filhos is not None:
+            return filhos
+    return _list_folder(pasta_id)
+
+
+def _index_put(meta: dict):
+    pasta_id = _parent_id(meta)
+    indice = _folder_index()
+    with indice["lock"]:
+        filhos = indice["pastas"].get(pasta_id)
+        if filhos is None:
+            return
+        for titulo in list(filhos):
+            filhos[titulo] = [m for m in filhos[titulo] if m['id'] != meta['id']]
+            if not filhos[titulo]:
+                del filhos[titulo]
+        filhos.setdefault(meta['title'], []).append(dict(meta))
+
+
+def _index_remove(meta: dict):
+    indice = _folder_index()
+    with indice["lock"]:
+        filhos = indice["pastas"].get(_parent_id(meta), {})
+        restantes = [m for m in filhos.get(meta['title'], []) if m['id'] != meta['id']]
+        if restantes:
+            filhos[meta['title']] = restantes
+        else:
+            filhos.pop(meta['title'], None)
+
+
+def _lookup(titulo: str, pasta_id: str, fresco: bool = False, pasta: bool = False):
+    candidatos = _folder_children(pasta_id, fresco).get(titulo, [])
+    if not candidatos and not fresco:
+        candidatos = _list_folder(pasta_id).get(titulo, [])
+    if pasta:
+        candidatos = [m for m in candidatos if m.get('mimeType') == PASTA_MIME]
+    if not candidatos:
+        return None
+    # se houver múltiplos, pega o mais recente por modifiedDate
+    return dict(max(candidatos, key=lambda x: x.get('modifiedDate', '')))
+
+
+def _delete_file(meta: dict):
+    obter_backend().delete(meta)
+    _index_remove(meta)
+
+
+def _subfolder_id(root_id: str, nome: str):
+    existente = _lookup(nome, root_id, pasta=True)
+    if existente is not None:
+        return existente['id']
+    meta = obter_backend().folder(nome, root_id)
+    _index_put(meta)
+    return meta['id']
+
+
+def _locks_folder_id(root_id: str):
+    return _subfolder_id(root_id, 'locks')
+
+# ---------- Transferência em memória ----------
+
+def _df_to_csv_bytes(df: pd.DataFrame):
+    buf = BytesIO()
+    df.to_csv(buf, sep=CSV_SEP, index=False, encoding=CSV_ENC)
+    return buf.getvalue()
+
+
+def _maybe_gzip(dados: bytes, titulo: str):
+    if not GZIP_OBJETOS_INTERNOS:
+        return dados, titulo
+    return gzip.compress(dados), f"{titulo}.gz"
+
+
+def _download_bytes(meta: dict):
+    dados = obter_backend().read(meta)
+    if dados[:2] == GZIP_MAGIC:
+        dados = gzip.decompress(dados)
+    return dados
+
+
+def _upload_bytes(meta: dict, dados: bytes | None, mimetype: str = "text/csv", condicional: bool = False):
+    # atualiza `meta` no lugar com os metadados devolvidos (id, version, etag, md5...)
+    meta.update(obter_backend().write(meta, dados, mimetype, condicional))
+    _index_put(meta)
+    return meta
 
 # ---------- Arquivos base ----------
 
-def _ensure_base_exists(title: str):
-    drive = conectar_drive()
-    root_id = obter_pasta_ts_fiscal_id()
-    files = drive.ListFile({'q': f"'{root_id}' in parents and title='{title}' and trashed=false"}).GetList()
-    if files:
-        return files[0]
+def _ensure_base_exists(title: str, parent_id: str | None = None, colunas: list | None = None):
+    root_id = parent_id or obter_backend().root_id()
+    existente = _lookup(title, root_id, fresco=True)
+    if existente is not None:
+        return existente
     # criar novo com colunas padrão
-    cols = BASES[title]
+    cols = colunas or BASES[title]
     df = pd.DataFrame(columns=cols)
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".csv").name
-    df.to_csv(tmp, sep=CSV_SEP, index=False, encoding=CSV_ENC)
-    f = drive.CreateFile({'title': title, 'parents': [{'id': root_id}]})
-    f.SetContentFile(tmp)
-    f.Upload()
+    return _upload_bytes({'title': title, 'parents': [{'id': root_id}]}, _df_to_csv_bytes(df))
+
+
+def _get_latest_by_title(title: str, parent_id: str | None = None, colunas: list | None = None, fresco: bool = False):
+    # fresco=True relista a pasta para ter version/modifiedDate atuais (leituras);
+    # escritas só precisam do id, que vem do índice
+    root_id = parent_id or obter_backend().root_id()
+    f = _lookup(title, root_id, fresco)
+    if f is None:
+        return _ensure_base_exists(title, parent_id, colunas)
     return f
 
 
-def _get_latest_by_title(title: str):
-    drive = conectar_drive()
-    root_id = obter_pasta_ts_fiscal_id()
-    files = drive.ListFile({'q': f"'{root_id}' in parents and title='{title}' and trashed=false"}).GetList()
-    if not files:
-        return _ensure_base_exists(title)
-    # se houver múltiplos, pega o mais recente por modifiedDate
-    files.sort(key=lambda x: x.get('modifiedDate', ''), reverse=True)
-    return files[0]
+def _find_by_title(title: str, parent_id: str | None = None, fresco: bool = False):
+    # como _get_latest_by_title, mas sem criar o arquivo quando não existe
+    return _lookup(title, parent_id or obter_backend().root_id(), fresco)
 
 
-def _read_csv_file(file_obj):
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".csv").name
-    file_obj.GetContentFile(tmp)
-    df = pd.read_csv(tmp, sep=CSV_SEP, encoding=CSV_ENC)
-    meta = {
+def _parent_id(file_obj):
+    parents = file_obj.get('parents') or []
+    return parents[0]['id'] if parents else obter_backend().root_id()
+
+
+def _meta_arquivo(file_obj):
+    return {
         'id': file_obj['id'],
         'title': file_obj['title'],
         'modifiedDate': file_obj.get('modifiedDate'),
         'version': file_obj.get('version'),
     }
-    return df, meta
 
 
-def carregar_base(title: str):
-    f = _get_latest_by_title(title)
-    return _read_csv_file(f)
+def _read_csv_file(file_obj):
+    df = pd.read_csv(BytesIO(_download_bytes(file_obj)), sep=CSV_SEP, encoding=CSV_ENC)
+    return df, _meta_arquivo(file_obj)
+
 
+# ---------- Snapshot colunar ----------
 
-def _save_csv_to_file(file_obj, df: pd.DataFrame):
+def _titulo_snapshot(title: str):
+    return title.rsplit('.', 1)[0] + SNAPSHOT_EXT
+
+
+def _carimbo_csv(file_obj):
+    # identifica o conteúdo do CSV que originou o snapshot (vai no campo description)
+    return f"csv={file_obj['id']}:{file_obj.get('md5Checksum') or file_obj.get('version')}"
+
+
+def _read_snapshot(csv_obj):
+    if not PARQUET_DISPONIVEL:
+        return None
+    snap = _find_by_title(_titulo_snapshot(csv_obj['title']), _parent_id(csv_obj))
+    # snapshot ausente ou gerado a partir de outra versão do CSV (ex.: edição manual): usa o CSV
+    if snap is None or snap.get('description') != _carimbo_csv(csv_obj):
+        return None
+    try:
+        return pd.read_parquet(BytesIO(_download_bytes(snap)))
+    except Exception:
+        return None
+
+
+def _save_snapshot(csv_obj, df: pd.DataFrame, base: str):
+    if not PARQUET_DISPONIVEL or base not in BASES:
+        return
+    try:
+        buf = BytesIO()
+        tipar_base(base, df.copy()).to_parquet(buf, index=False)
+        titulo = _titulo_snapshot(csv_obj['title'])
+        parent_id = _parent_id(csv_obj)
+        snap = _find_by_title(titulo, parent_id)
+        if snap is None:
+            snap = {'title': titulo, 'parents': [{'id': parent_id}]}
+        snap['description'] = _carimbo_csv(csv_obj)
+        _upload_bytes(snap, buf.getvalue(), "application/octet-stream")
+    except Exception:
+        # o snapshot é só aceleração de leitura; o CSV já foi gravado e, com o carimbo
+        # antigo, a leitura usa o CSV
+        log.warning("Snapshot de %s não atualizado", csv_obj.get('title'), exc_info=True)
+
+
+# ---------- Cache de leitura (compartilhado entre sessões) ----------
+
+@st.cache_resource(show_spinner=False)
+def _cache_bases():
+    # (title, parte) -> {"chave": (id, version, modifiedDate), "df": DataFrame}
+    # parte: None (base inteira), "AAAA-MM" (partição) ou "journal:<id>" (delta)
+    # em_voo: (title, parte, versão) -> Future do download em andamento
+    return {"lock": threading.Lock(), "itens": {}, "em_voo": {}}
+
+
+def _chave_versao(file_obj):
+    return (file_obj['id'], file_obj.get('version'), file_obj.get('modifiedDate'))
+
+
+def invalidar_cache_base(title: str, parte: str | None = None):
+    cache = _cache_bases()
+    with cache["lock"]:
+        for chave in [k for k in cache["itens"] if k[0] == title and (parte is None or k[1] == parte)]:
+            del cache["itens"][chave]
+
+
+def memoria_cache_df():
+    # memória de cada parte no cache compartilhado (cada sessão soma as suas cópias filtradas)
+    cache = _cache_bases()
+    with cache["lock"]:
+        itens = list(cache["itens"].items())
+    linhas = [
+        {"Base": title, "Parte": parte or "", "Linhas": len(item["df"]),
+         "MB": round(item["df"].memory_usage(deep=True).sum() / 2 ** 20, 2)}
+        for (title, parte), item in sorted(itens, key=lambda x: (x[0][0], str(x[0][1])))
+    ]
+    return pd.DataFrame(linhas, columns=["Base", "Parte", "Linhas", "MB"])
+
+
+def _prune_journal_cache(title: str, ids_atuais: set):
+    # remove deltas já compactados (inclusive por outros processos)
+    cache = _cache_bases()
+    with cache["lock"]:
+        for chave in [k for k in cache["itens"] if k[0] == title and str(k[1]).startswith("journal:")]:
+            if chave[1].split(":", 1)[1] not in ids_atuais:
+                del cache["itens"][chave]
+
+
+def _load_cached(title: str, parte: str | None, file_obj, snapshot: bool = True):
+    # a listagem do Drive já traz version/modifiedDate: só baixa se a versão mudou.
+    # Sessões que pedem a mesma versão ao mesmo tempo esperam o download de quem chegou
+    # primeiro (um download e um parse por versão, qualquer que seja o número de usuários).
+    # O DataFrame é compartilhado e só é lido aqui dentro: carregar_base e _ultima_copia
+    # entregam sempre uma cópia (concat_rows), que as páginas podem alterar no lugar.
+    chave = _chave_versao(file_obj)
+    cache = _cache_bases()
+    with cache["lock"]:
+        item = cache["itens"].get((title, parte))
+        if item is not None and item["chave"] == chave:
+            return item["df"]
+        voo = cache["em_voo"].get((title, parte, chave))
+        lider = voo is None
+        if lider:
+            voo = cache["em_voo"][(title, parte, chave)] = Future()
+    if not lider:
+        return voo.result()
+    try:
+        df = _read_snapshot(file_obj) if snapshot else None
+        if df is None:
+            df, _ = _read_csv_file(file_obj)
+        sem_minutos = "Minutos" in BASES.get(title, []) and ("Minutos" not in df.columns or df["Minutos"].isna().any())
+        if sem_minutos and not str(parte).startswith("journal:"):
+            # objeto anterior à coluna Minutos: completa na leitura e agenda o preenchimento definitivo
+            agendar_preenchimento_minutos(title)
+        df = tipar_base(title, df)
+    except BaseException as e:
+        with cache["lock"]:
+            cache["em_voo"].pop((title, parte, chave), None)
+        voo.set_exception(e)
+        raise
+    with cache["lock"]:
+        cache["em_voo"].pop((title, parte, chave), None)
+        cache["itens"][(title, parte)] = {"chave": chave, "df": df}
+    voo.set_result(df)
+    return df
+
+
+def _ultima_copia(title: str, periodo=None, colunas=None):
+    # leitura sem o Drive: junta o que o cache de leitura ainda tem da base (inteira ou
+    # partições do período, mais os deltas do journal já baixados); None se não houver nada
+    meses_periodo = _months_in_period(periodo) if periodo else None
+    cache = _cache_bases()
+    with cache["lock"]:
+        partes = {parte: item["df"] for (t, parte), item in cache["itens"].items() if t == title}
+    frames = [partes[p] for p in sorted(partes, key=str)
+              if not str(p).startswith("journal:") and (p is None or meses_periodo is None or p in meses_periodo)]
+    if not frames:
+        return None
+    manifesto = _ultimos_manifestos().get(title) if title in PARTICIONADAS else None
+    incorporadas = _incorporadas_por_parte(title, manifesto=manifesto) if manifesto is not None else {}
+    for p, df_e in partes.items():
+        if str(p).startswith("journal:"):
+            df_e = _linhas_pendentes(df_e, p[len("journal:"):], incorporadas)
+            if meses_periodo is not None and 'Data' in df_e.columns:
+                df_e = df_e[df_e['Data'].dt.strftime('%Y-%m').isin(meses_periodo)]
+            frames.append(df_e)
+    return concat_rows(frames, colunas)
+
+
+@_medir_chamadas("carregar_base")
+def carregar_base(title: str, periodo=None, colunas=None):
+    # colunas: devolve só essas (a cópia da sessão não carrega o que a página não usa).
+    # Com o Drive indisponível (tentativas esgotadas ou circuito aberto), serve a última
+    # cópia em cache; as escritas falham até o Drive voltar, então a página fica só leitura
+    try:
+        return _ler_base(title, periodo, colunas)
+    except DriveIndisponivel:
+        df = _ultima_copia(title, periodo, colunas)
+        if df is None:
+            raise
+        st.warning(f"⚠️ Google Drive indisponível: exibindo a última cópia carregada de {title}. "
+                   "Alterações ficam bloqueadas até a conexão voltar.")
+        return df, {'title': title, 'somente_leitura': True}
+
+
+def _ler_base(title: str, periodo=None, colunas=None):
+    # periodo=(data_inicial, data_final): em bases particionadas, só baixa os meses do período.
+    # Em bases com journal, lista os deltas antes da base: se uma compactação acontecer
+    # no meio, as partições gravadas registram as entradas incorporadas e elas são puladas.
+    entradas = _list_journal(title) if title in JOURNAL_BASES else []
+    meses_periodo = _months_in_period(periodo) if periodo else None
+    if title in PARTICIONADAS:
+        manifesto = manifesto_particoes(title)
+        meses = [m for m in sorted(manifesto) if meses_periodo is None or m in meses_periodo]
+        frames = [_load_cached(title, m, manifesto[m]['file']) for m in meses]
+        meta = {'title': title, 'particoes': {m: manifesto[m]['file'].get('version') for m in meses}}
+        incorporadas = _incorporadas_por_parte(title, manifesto=manifesto)
+        if not frames:
+            frames = [tipar_base(title, pd.DataFrame(columns=BASES[title]))]
+    else:
+        # a mesma listagem traz a versão do CSV e o carimbo do snapshot
+        f = _get_latest_by_title(title, fresco=True)
+        frames = [_load_cached(title, None, f)]
+        meta = _meta_arquivo(f)
+        incorporadas = _incorporadas_por_parte(title, file_obj=f)
+    frames += _deltas_journal(title, entradas, incorporadas, meses_periodo)
+    return concat_rows(frames, colunas), meta
+
+
+def _deltas_journal(title: str, entradas, incorporadas: dict, meses_periodo=None):
+    # linhas ainda não compactadas das entradas do journal, listadas antes da base por quem
+    # chama; entradas removidas por uma compactação concorrente no meio ficam de fora
+    if not entradas:
+        return []
+    _prune_journal_cache(title, {e['id'] for e in entradas})
+    deltas = []
+    for e in entradas:
+        try:
+            df_e = _load_cached(title, f"journal:{e['id']}", e, snapshot=False)
+        except Exception:
+            continue
+        df_e = _linhas_pendentes(df_e, e['id'], incorporadas)
+        if meses_periodo is not None and 'Data' in df_e.columns:
+            df_e = df_e[df_e['Data'].dt.strftime('%Y-%m').isin(meses_periodo)]
+        deltas.append(df_e)
+    if _journal_needs_compaction(entradas):
+        agendar_compactacao(title)
+    return deltas
+
+
+@st.cache_resource(show_spinner=False)
+def _executor_leituras():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="leitura-bases")
+
+
+def carregar_bases(*titles: str):
+    # bases independentes são baixadas em paralelo: a página espera só pela mais lenta.
+    # Devolve {title: (df, meta)}, como chamadas sucessivas a carregar_base.
+    ctx = get_script_run_ctx()
+
+    def _carregar(title):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return carregar_base(title)
+
+    executor = _executor_leituras()
+    futuros = {title: executor.submit(_carregar, title) for title in titles}
+    return {title: futuro.result() for title, futuro in futuros.items()}
+
+
+def _save_csv_to_file(file_obj, df: pd.DataFrame, base: str | None = None, condicional: bool = False):
+    # devolve também os bytes enviados, reaproveitados pelo backup sem serializar de novo
+    # completa Minutos das linhas antigas: toda reescrita já grava a coluna preenchida
+    if "Minutos" in BASES.get(base or file_obj['title'], []):
+        df = completar_minutos(df)
     # normaliza Data (se existir) para ISO string
     if 'Data' in df.columns:
         df['Data'] = pd.to_datetime(df['Data'], errors='coerce').dt.strftime('%Y-%m-%d')
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".csv").name
-    df.to_csv(tmp, sep=CSV_SEP, index=False, encoding=CSV_ENC)
-    file_obj.SetContentFile(tmp)
-    file_obj.Upload()
+    dados = _df_to_csv_bytes(df)
+    _upload_bytes(file_obj, dados, condicional=condicional)
+    _save_snapshot(file_obj, df, base or file_obj['title'])
+    _save_cubo(file_obj, df, base or file_obj['title'])
+    return file_obj, dados
+
+# ---------- Cubo do Dashboard ----------
+# Cada objeto da base (a partição do mês, ou a base inteira) tem o seu cubo, regravado na
+# mesma escrita a partir do DataFrame que acabou de ser salvo: só os meses tocados mudam e
+# não há leitura extra. O carimbo (versão do CSV) invalida cubos de CSVs editados à mão;
+# sem cubo válido, a leitura agrega as linhas uma vez e regrava o cubo.
+
+def _titulo_cubo(title: str):
+    return title.rsplit('.', 1)[0] + CUBO_EXT
+
+
+def _save_cubo(csv_obj, df: pd.DataFrame, base: str):
+    if base not in CUBO_BASES:
+        return
+    try:
+        titulo = _titulo_cubo(csv_obj['title'])
+        parent_id = _parent_id(csv_obj)
+        cubo = _find_by_title(titulo, parent_id)
+        if cubo is None:
+            cubo = {'title': titulo, 'parents': [{'id': parent_id}]}
+        cubo['description'] = _carimbo_csv(csv_obj)
+        _upload_bytes(cubo, gzip.compress(_df_to_csv_bytes(rollup_cubo(df, CUBO_DIMENSOES))), "application/gzip")
+    except Exception:
+        # o cubo é derivado: sem ele (ou com carimbo velho) a leitura refaz a partir das linhas
+        log.warning("Cubo de %s não atualizado", csv_obj.get('title'), exc_info=True)
+
+
+def _cubo_do_objeto(title: str, parte: str | None, csv_obj):
+    cubo = _find_by_title(_titulo_cubo(csv_obj['title']), _parent_id(csv_obj))
+    if cubo is not None and cubo.get('description') == _carimbo_csv(csv_obj):
+        try:
+            return _load_cached(f"cubo:{title}", parte, cubo, snapshot=False)
+        except Exception:
+            pass
+    df = _load_cached(title, parte, csv_obj)
+    _save_cubo(csv_obj, df, title)
+    return rollup_cubo(df, CUBO_DIMENSOES)
+
+
+@_medir_chamadas("carregar_cubo")
+def carregar_cubo(title: str, periodo=None):
+    # linhas do cubo no período (Data = dia, com Minutos, Quantidade e Registros somados):
+    # cubos das partições do período (ou da base) mais o rollup do journal, feito na leitura.
+    # O journal é listado antes das partições: entradas que uma compactação concorrente já
+    # incorporou estão registradas nelas e são puladas (no cubo não há ID para deduplicar)
+    try:
+        entradas = _list_journal(title) if title in JOURNAL_BASES else []
+        meses_periodo = _months_in_period(periodo) if periodo else None
+        if title in PARTICIONADAS:
+            manifesto = manifesto_particoes(title)
+            partes = [(m, manifesto[m]['file']) for m in sorted(manifesto) if meses_periodo is None or m in meses_periodo]
+            incorporadas = _incorporadas_por_parte(title, manifesto=manifesto)
+        else:
+            partes = [(None, _get_latest_by_title(title, fresco=True))]
+            incorporadas = _incorporadas_por_parte(title, file_obj=partes[0][1])
+        frames = [_cubo_do_objeto(title, parte, f) for parte, f in partes]
+        deltas = _deltas_journal(title, entradas, incorporadas, meses_periodo)
+        if deltas:
+            frames.append(rollup_cubo(concat_rows(deltas), CUBO_DIMENSOES))
+        # versões de tudo o que entrou no cubo: identificam o conteúdo para o cache do Dashboard
+        meta = {'title': title, 'partes': {parte: _chave_versao(f) for parte, f in partes},
+                'journal': tuple(sorted(e['id'] for e in entradas))}
+    except DriveIndisponivel:
+        cubo = _ultima_copia(f"cubo:{title}", periodo)
+        if cubo is None:
+            df = _ultima_copia(title, periodo)
+            if df is None:
+                raise
+            cubo = rollup_cubo(df, CUBO_DIMENSOES)
+        st.warning(f"⚠️ Google Drive indisponível: exibindo a última cópia carregada de {title}.")
+        return concat_cubos([cubo], CUBO_DIMENSOES, periodo), {'title': title, 'somente_leitura': True}
+    if not frames:
+        frames = [rollup_cubo(tipar_base(title, pd.DataFrame(columns=BASES[title])), CUBO_DIMENSOES)]
+    return concat_cubos(frames, CUBO_DIMENSOES, periodo), meta
+
+
+# ---------- Backups incrementais ----------
+
+def _backup_folder_id(title: str):
+    base_sem_ext = title.rsplit('.', 1)[0]
+    return _subfolder_id(obter_backend().root_id(), f"Backup_{base_sem_ext}")
+
+
+def _backup_nome(title: str, particao: str | None = None):
+    base_sem_ext = title.rsplit('.', 1)[0]
+    return f"{base_sem_ext}_{particao}" if particao else base_sem_ext
+
+
+def _parse_backup(titulo: str):
+    # {nome}__{ts}__{tipo}__rev-x.csv[.gz]; os backups antigos ({nome}__{ts}__rev-x) são cópias completas
+    partes = titulo.split('__')
+    if len(partes) == 4:
+        nome, ts, tipo, _ = partes
+    elif len(partes) == 3:
+        nome, ts, _ = partes
+        tipo = "checkpoint"
+    else:
+        return None
+    for fmt in ('%Y%m%d_%H%M%S_%f', '%Y%m%d_%H%M%S'):
+        try:
+            return nome, datetime.strptime(ts, fmt), tipo
+        except ValueError:
+            pass
+    return None
+
+
+def _backups_da_base(title: str, particao: str | None = None, fresco: bool = False):
+    # [(ts, tipo, meta)] da base/partição em ordem cronológica
+    nome = _backup_nome(title, particao)
+    itens = []
+    for titulo, metas in _folder_children(_backup_folder_id(title), fresco).items():
+        info = _parse_backup(titulo)
+        if info is None or info[0] != nome:
+            continue
+        itens.extend((info[1], info[2], m) for m in metas)
+    itens.sort(key=lambda x: x[0])
+    return itens
+
+
+def salvar_backup(dados: bytes, base_title: str, revision: str | None, particao: str | None = None):
+    # cópia completa (checkpoint); usada direto pelos cadastros, que são pequenos e não têm ID
+    ts = datetime.now()
+    _enfileirar_backup(f"{_backup_nome(base_title, particao)} checkpoint", (base_title, particao),
+                       lambda: obter_backend().backup(dados, base_title, revision, particao, ts=ts))
+
+
+def _gravar_backup_incremental(title: str, operacao: str, linhas: pd.DataFrame, revision: str | None,
+                               dados_base: bytes, particao: str | None, usuario: str | None, ts: datetime):
+    backups = _backups_da_base(title, particao)
+    ultimo_cp = max((i for i, (_, tipo, _) in enumerate(backups) if tipo == "checkpoint"), default=None)
+    if ('ID' not in linhas.columns or ultimo_cp is None or len(backups) - 1 - ultimo_cp >= BACKUP_CHECKPOINT_A_CADA
+            or _checkpoint_forcado(title, particao)):
+        return obter_backend().backup(dados_base, title, revision, particao, ts=ts)
+    delta = linhas.copy()
+    if 'Data' in delta.columns:
+        delta['Data'] = pd.to_datetime(delta['Data'], errors='coerce').dt.strftime('%Y-%m-%d')
+    delta['_operacao'] = operacao
+    delta['_usuario'] = usuario
+    delta['_registrado_em'] = ts.isoformat()
+    delta['_versao_base'] = revision
+    obter_backend().backup(_df_to_csv_bytes(delta), title, revision, particao, tipo=operacao, ts=ts)
+
+
+def registrar_backup(title: str, operacao: str, linhas: pd.DataFrame, revision: str | None, dados_base: bytes,
+                     particao: str | None = None, usuario: str | None = None):
+    # operacao: insert | update | delete. Grava só as linhas afetadas com o registro da operação;
+    # sem checkpoint anterior ou a cada BACKUP_CHECKPOINT_A_CADA deltas, grava a cópia completa
+    # (dados_base, já serializada pelo salvamento) no lugar do delta. A gravação vai para a fila
+    # de backups: quem chama (e o lock que segura) não espera o upload
+    usuario = usuario or st.session_state.get("username")
+    linhas, ts = linhas.copy(), datetime.now()
+    _enfileirar_backup(f"{_backup_nome(title, particao)} {operacao} ({len(linhas)} linhas)", (title, particao),
+                       lambda: _gravar_backup_incremental(title, operacao, linhas, revision, dados_base, particao, usuario, ts))
+
+
+def restaurar_backup(title: str, ate: datetime | None = None, particao: str | None = None):
+    # estado da base (ou de uma partição) em `ate`: último checkpoint até ali + deltas seguintes
+    if particao is None and title in PARTICIONADAS:
+        prefixo = f"{_backup_nome(title)}_"
+        nomes = set()
+        for titulo in _folder_children(_backup_folder_id(title), fresco=True):
+            info = _parse_backup(titulo)
+            if info is not None and info[0].startswith(prefixo):
+                nomes.add(info[0][len(prefixo):])
+        frames = [restaurar_backup(title, ate, p) for p in sorted(nomes)]
+        return concat_rows(frames) if frames else pd.DataFrame(columns=BASES[title])
+    backups = [b for b in _backups_da_base(title, particao, fresco=True) if ate is None or b[0] <= ate]
+    inicio = max((i for i, (_, tipo, _) in enumerate(backups) if tipo == "checkpoint"), default=None)
+    if inicio is None:
+        return pd.DataFrame(columns=BASES.get(title, []))
+    df, _ = _read_csv_file(backups[inicio][2])
+    colunas = list(df.columns)
+    for _, tipo, meta in backups[inicio + 1:]:
+        delta, _ = _read_csv_file(meta)
+        linhas = delta[[c for c in delta.columns if not c.startswith('_')]]
+        if tipo == "delete":
+            df = df[~df['ID'].isin(linhas['ID'])]
+        else:
+            df = _merge_rows(df, linhas)
+    return df.reindex(columns=colunas).reset_index(drop=True)
+
+# ---------- Backups em segundo plano ----------
+# Durabilidade: a escrita na base (ou no journal) é durável quando a função de escrita retorna;
+# o backup correspondente entra numa fila limitada e é gravado por um worker único (na ordem
+# de chegada, o que mantém a cadeia de deltas de cada base em ordem), com novas tentativas.
+# No encerramento normal do processo a fila é descarregada por até BACKUP_FLUSH_SEG.
+# Jobs perdidos (queda do processo, fila cheia, falha definitiva) não perdem dados da base,
+# só abrem um buraco na cadeia de deltas: o próximo backup daquela base/partição é um
+# checkpoint completo, que fecha o buraco. As falhas ficam visíveis para os admins.
+
+@st.cache_resource(show_spinner=False)
+def _fila_backups():
+    estado = {"fila": queue.Queue(maxsize=BACKUP_FILA_MAX), "lock": threading.Lock(), "worker": None,
+              "concluidos": 0, "falhas": [], "checkpoint_forcado": set()}
+    atexit.register(_descarregar_backups, estado)
+    return estado
+
+
+def _checkpoint_forcado(title: str, particao: str | None):
+    estado = _fila_backups()
+    with estado["lock"]:
+        if (title, particao) in estado["checkpoint_forcado"]:
+            estado["checkpoint_forcado"].discard((title, particao))
+            return True
+    return False
+
+
+def _registrar_falha_backup(estado, descricao: str, chave, erro: str):
+    with estado["lock"]:
+        estado["falhas"].append({"Backup": descricao, "Erro": erro, "Quando": datetime.now().strftime('%d/%m %H:%M:%S')})
+        del estado["falhas"][:-BACKUP_FALHAS_MAX]
+        estado["checkpoint_forcado"].add(chave)
+
+
+def _executar_backup(estado, descricao: str, chave, tarefa):
+    erro = None
+    for tentativa in range(BACKUP_TENTATIVAS):
+        try:
+            tarefa()
+            with estado["lock"]:
+                estado["concluidos"] += 1
+            return
+        except Exception as e:
+            erro = str(e)
+            if tentativa + 1 < BACKUP_TENTATIVAS:
+                time.sleep(LOCK_BACKOFF_INICIAL_SEG * 2 ** tentativa)
+    _registrar_falha_backup(estado, descricao, chave, erro)
+
+
+def _processar_backups(estado):
+    while True:
+        descricao, chave, tarefa = estado["fila"].get()
+        try:
+            _executar_backup(estado, descricao, chave, tarefa)
+        finally:
+            estado["fila"].task_done()
+
+
+def _enfileirar_backup(descricao: str, chave, tarefa):
+    # chave: (base, partição), para forçar um checkpoint se este job se perder
+    estado = _fila_backups()
+    with estado["lock"]:
+        if estado["worker"] is None or not estado["worker"].is_alive():
+            estado["worker"] = threading.Thread(target=_processar_backups, args=(estado,), name="fila-backups", daemon=True)
+            estado["worker"].start()
+    try:
+        # fila cheia segura o escritor por até BACKUP_FILA_ESPERA_SEG (contrapressão)
+        estado["fila"].put((descricao, chave, tarefa), timeout=BACKUP_FILA_ESPERA_SEG)
+    except queue.Full:
+        _registrar_falha_backup(estado, descricao, chave, "fila de backups cheia")
+
+
+def _descarregar_backups(estado, timeout: float = BACKUP_FLUSH_SEG):
+    fim = time.time() + timeout
+    while estado["fila"].unfinished_tasks and time.time() < fim:
+        time.sleep(0.1)
+
+
+def estado_backups():
+    estado = _fila_backups()
+    with estado["lock"]:
+        return {"pendentes": estado["fila"].unfinished_tasks, "concluidos": estado["concluidos"],
+                "falhas": pd.DataFrame(estado["falhas"], columns=["Backup", "Erro", "Quando"])}
+
+# ---------- Escrita otimista ----------
+
+def _acquire_locks(nomes, owner: str | None = None):
+    # ordem fixa evita deadlock entre escritas que tocam os mesmos objetos
+    locks = []
+    for nome in sorted(set(nomes)):
+        lock = criar_lock(nome, owner=owner)
+        if not lock.acquire():
+            _release_locks(locks)
+            return None
+        locks.append(lock)
+    return locks
+
+
+def _release_locks(locks):
+    for lock in reversed(locks):
+        lock.release()
+
+
+def _reaplicar(operacao):
+    for tentativa in range(ESCRITA_OTIMISTA_TENTATIVAS):
+        try:
+            return operacao()
+        except ConflitoVersao:
+            if tentativa == ESCRITA_OTIMISTA_TENTATIVAS - 1:
+                raise
+            time.sleep(random.uniform(0, LOCK_BACKOFF_INICIAL_SEG * 2 ** tentativa))
+
+
+def _executar_escrita(nomes_lock, operacao, owner: str | None = None, avisar: bool = True):
+    try:
+        return _escrever(nomes_lock, operacao, owner, avisar)
+    except DriveIndisponivel:
+        if avisar:
+            st.error("Google Drive indisponível no momento. A gravação não foi confirmada; confira e tente novamente em alguns instantes.")
+        return False
+
+
+def regravar_base(title: str, df: pd.DataFrame):
+    # regravação completa de uma base pequena de cadastro (sem ID), sob o lock da base.
+    # Com o Drive indisponível nada é gravado e a página segue só leitura
+    try:
+        lock = criar_lock(title)
+        if not lock.acquire():
+            return False
+        try:
+            file = _get_latest_by_title(title)
+            file, dados = _save_csv_to_file(file, df)
+            invalidar_cache_base(title)
+            salvar_backup(dados, title, file.get('version'))
+            return True
+        finally:
+            lock.release()
+    except DriveIndisponivel:
+        st.warning(f"⚠️ Google Drive indisponível: {title} está em modo somente leitura. "
+                   "A alteração não foi gravada; tente novamente quando a conexão voltar.")
+        return False
+
+
+def _escrever(nomes_lock, operacao, owner: str | None, avisar: bool):
+    # operacao() relê o que vai alterar, aplica a mudança e grava condicionada à versão lida
+    # (ConflitoVersao se outro escritor passou na frente), então pode ser repetida à vontade.
+    # Sem disputa custa uma leitura e um upload, sem lock; se os conflitos persistirem,
+    # repete com os locks de nomes_lock para serializar os escritores.
+    if ESCRITA_OTIMISTA:
+        try:
+            return _reaplicar(operacao)
+        except ConflitoVersao:
+            pass
+    locks = _acquire_locks(nomes_lock, owner)
+    if locks is None:
+        if avisar:
+            st.error("Sistema ocupado. Tente novamente em alguns segundos.")
+        return False
+    try:
+        return _reaplicar(operacao)
+    except ConflitoVersao:
+        if avisar:
+            st.error("Sistema ocupado. Tente novamente em alguns segundos.")
+        return False
+    finally:
+        _release_locks(locks)
+
+# ---------- Journal de lançamentos ----------
+
+def _journal_folder_id(title: str):
+    base_sem_ext = title.rsplit('.', 1)[0]
+    return _subfolder_id(obter_backend().root_id(), f"journal_{base_sem_ext}")
+
+
+def _list_journal(title: str):
+    filhos = _folder_children(_journal_folder_id(title), fresco=True)
+    entradas = [dict(m) for metas in filhos.values() for m in metas]
+    # o título começa pelo timestamp do envio: ordem alfabética = ordem de chegada
+    entradas.sort(key=lambda x: x['title'])
+    return entradas
+
+
+def _journal_incorporado(file_obj):
+    # ids das entradas do journal já incorporadas no objeto (partição ou base), gravados no
+    # description no mesmo upload do CSV. A exclusão das entradas depois da compactação é
+    # best-effort: uma entrada que sobreviver não pode voltar a valer (ressuscitaria uma
+    # linha excluída ou desfaria uma edição posterior), nem na leitura nem na compactação
+    try:
+        return set(json.loads(file_obj.get('description') or '{}').get('journal', []))
+    except (ValueError, AttributeError, TypeError):
+        return set()
+
+
+def _incorporadas_por_parte(title: str, manifesto=None, file_obj=None):
+    # {parte: ids incorporados}; parte = mês (bases particionadas) ou None (base inteira)
+    if manifesto is not None:
+        return {m: _journal_incorporado(info['file']) for m, info in manifesto.items()}
+    return {None: _journal_incorporado(file_obj)} if file_obj is not None else {}
+
+
+def _linhas_pendentes(df_e: pd.DataFrame, entrada_id: str, incorporadas: dict):
+    # linhas de uma entrada do journal que ainda não estão na partição (ou base) de destino
+    partes = {p for p, ids in incorporadas.items() if entrada_id in ids}
+    if not partes:
+        return df_e
+    if None in partes:
+        return df_e.iloc[0:0]
+    meses = _partition_key(df_e['Data']) if 'Data' in df_e.columns else pd.Series(PARTICAO_SEM_DATA, index=df_e.index)
+    return df_e[~meses.isin(partes)]
+
+
+def _ids_journal(anteriores: set, novas, vivas: set):
+    # registro de entradas incorporadas: as já registradas que ainda existem no journal
+    # (as apagadas não precisam mais de registro) mais as incorporadas agora
+    return sorted((anteriores & vivas) | set(novas))
+
+
+def _read_journal(entradas, incorporadas: dict | None = None):
+    # devolve as linhas ainda não incorporadas, a entrada de origem de cada linha e as
+    # entradas lidas (que podem ser apagadas depois de gravar)
+    frames, origens, lidas = [], [], []
+    for e in entradas:
+        try:
+            df, _ = _read_csv_file(e)
+        except Exception:
+            # entrada removida por uma compactação concorrente (ou falha transitória)
+            continue
+        df = _linhas_pendentes(df, e['id'], incorporadas or {})
+        frames.append(df)
+        origens.append(pd.Series(e['id'], index=range(len(df)), dtype=object))
+        lidas.append(e)
+    if not frames:
+        return pd.DataFrame(), pd.Series(dtype=object), lidas
+    return pd.concat(frames, ignore_index=True), pd.concat(origens, ignore_index=True), lidas
+
+
+def _journal_needs_compaction(entradas):
+    if len(entradas) >= JOURNAL_MAX_ENTRADAS:
+        return True
+    try:
+        mais_antiga = datetime.strptime(entradas[0]['title'].split('__')[0], '%Y%m%d_%H%M%S_%f')
+    except (IndexError, ValueError):
+        return False
+    return (datetime.now() - mais_antiga).total_seconds() > JOURNAL_MAX_IDADE_SEG
+
+
+def _append_journal(title: str, df_new: pd.DataFrame):
+    # grava só o delta: custo constante, sem lock e sem baixar a base.
+    # Não invalida o cache: a próxima leitura lista o journal e enxerga o delta novo.
+    ts = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    dados, fname = _maybe_gzip(_df_to_csv_bytes(df_new), f"{ts}__{gerar_id_unico()}.csv")
+    _upload_bytes({'title': fname, 'parents': [{'id': _journal_folder_id(title)}]}, dados,
+                  "application/gzip" if fname.endswith(".gz") else "text/csv")
+    entradas = _list_journal(title)
+    if entradas and _journal_needs_compaction(entradas):
+        agendar_compactacao(title)
+    return True
+
+
+def _fold_journal(title: str, df: pd.DataFrame, file_obj):
+    # incorpora o journal na base já lida de file_obj (chamar com o lock da base) e registra
+    # as entradas no description de file_obj, que vai no mesmo upload; devolve as entradas
+    # que podem ser apagadas depois de salvar e as linhas incorporadas
+    if title not in JOURNAL_BASES:
+        return df, [], pd.DataFrame()
+    entradas = _list_journal(title)
+    anteriores = _journal_incorporado(file_obj)
+    df_journal, _, lidas = _read_journal(entradas, {None: anteriores})
+    if not lidas:
+        return df, [], df_journal
+    file_obj['description'] = json.dumps({'journal': _ids_journal(
+        anteriores, [e['id'] for e in lidas], {e['id'] for e in entradas})})
+    return _merge_rows(df, df_journal), lidas, df_journal
+
+
+def _delete_journal_entries(title: str, entradas):
+    for e in entradas:
+        try:
+            _delete_file(e)
+        except Exception:
+            # a entrada já está registrada no objeto que a incorporou (ignorada na leitura);
+            # a próxima compactação tenta apagá-la de novo
+            pass
+        invalidar_cache_base(title, f"journal:{e['id']}")
+
+
+@_medir_chamadas("compactar_journal")
+def compactar_journal(title: str, owner: str = "compactacao"):
+    if title in PARTICIONADAS:
+        # cada mês do journal vai para a sua partição, com escrita só naquela partição;
+        # _insert_partition descarta o que a partição já registra como incorporado
+        entradas = _list_journal(title)
+        df_journal, origem, lidas = _read_journal(entradas)
+        if not lidas:
+            return True
+        if not _append_partitioned(title, df_journal, owner=owner,
+                                   journal=(origem, {e['id'] for e in entradas})):
+            return False
+        _delete_journal_entries(title, lidas)
+        return True
+
+    def _compactar():
+        file = _get_latest_by_title(title, fresco=True)
+        df_cur, meta = _read_csv_file(file)
+        df_merged, lidas, df_journal = _fold_journal(title, df_cur, file)
+        if not lidas:
+            return True
+        file, dados = _save_csv_to_file(file, df_merged, condicional=True)
+        registrar_backup(title, "insert", df_journal, file.get('version'), dados, usuario=owner)
+        # só apaga o que foi efetivamente lido e gravado na base
+        _delete_journal_entries(title, lidas)
+        invalidar_cache_base(title, None)
+        return True
+
+    return _executar_escrita([title], _compactar, owner, avisar=False)
+
+
+@st.cache_resource(show_spinner=False)
+def _compactacoes_em_andamento():
+    return {"lock": threading.Lock(), "bases": set()}
+
+
+def agendar_compactacao(title: str):
+    # uma compactação por base por processo; entre processos, o lock do backend serializa
+    estado = _compactacoes_em_andamento()
+    with estado["lock"]:
+        if title in estado["bases"]:
+            return
+        estado["bases"].add(title)
+
+    def _executar():
+        try:
+            compactar_journal(title)
+        except Exception:
+            pass
+        finally:
+            with estado["lock"]:
+                estado["bases"].discard(title)
+
+    t = threading.Thread(target=_executar, name=f"compactacao-{title}", daemon=True)
+    add_script_run_ctx(t)
+    t.start()
+
+# ---------- Partições mensais ----------
+
+def _partitions_folder_id(title: str):
+    base_sem_ext = title.rsplit('.', 1)[0]
+    return _subfolder_id(obter_backend().root_id(), base_sem_ext)
+
+
+def _partition_key(datas: pd.Series):
+    parsed = pd.to_datetime(datas, errors='coerce', format='%Y-%m-%d')
+    return parsed.dt.strftime('%Y-%m').fillna(PARTICAO_SEM_DATA)
+
+
+def _months_in_period(periodo):
+    ini, fim = periodo
+    return set(pd.period_range(pd.Timestamp(ini), pd.Timestamp(fim), freq='M').strftime('%Y-%m'))
+
+
+def _list_partition_files(title: str, filhos: dict | None = None):
+    if filhos is None:
+        filhos = _folder_children(_partitions_folder_id(title), fresco=True)
+    return [dict(m) for titulo, metas in filhos.items() if titulo.endswith('.csv') for m in metas]
+
+
+class BaseEmMigracao(DriveIndisponivel):
+    # outro processo está dividindo a base monolítica: as partições ainda estão incompletas
+    pass
+
+
+@st.cache_resource(show_spinner=False)
+def _ultimos_manifestos():
+    # title -> último manifesto listado pelo processo (período padrão com o Drive fora)
+    return {}
+
+
+def manifesto_particoes(title: str):
+    # o manifesto é a própria listagem da pasta: cada partição guarda
+    # linhas/min/max no description, atualizado no mesmo upload do CSV.
+    # Sem o marcador da migração as partições podem estar pela metade: migra (ou retoma)
+    # antes de ler; se outro processo estiver migrando, a página segue só leitura
+    filhos = _folder_children(_partitions_folder_id(title), fresco=True)
+    if PARTICAO_MARCADOR not in filhos:
+        if not _migrate_to_partitions(title):
+            raise BaseEmMigracao(f"{title}: migração para partições em andamento")
+        filhos = _folder_children(_partitions_folder_id(title), fresco=True)
+    files = _list_partition_files(title, filhos)
+    manifesto = {}
+    for f in sorted(files, key=lambda x: x.get('modifiedDate', '')):
+        try:
+            info = json.loads(f.get('description') or '{}')
+        except ValueError:
+            info = {}
+        manifesto[f['title'][:-len('.csv')]] = {**info, 'file': f}
+    _ultimos_manifestos()[title] = manifesto
+    return manifesto
+
+
+def intervalo_base(title: str):
+    # período padrão dos filtros sem baixar as linhas (estatísticas do manifesto).
+    # Com o Drive indisponível usa o último manifesto listado (ou hoje), para a página
+    # seguir até a carga, que cai na cópia só leitura
+    hoje = date.today()
+    try:
+        if title not in PARTICIONADAS:
+            df, _ = carregar_base(title, colunas=["Data"])
+            datas = pd.to_datetime(df['Data'], errors='coerce') if 'Data' in df.columns else pd.Series(dtype='datetime64[ns]')
+            if datas.notnull().any():
+                return [datas.min().date(), datas.max().date()]
+            return [hoje, hoje]
+        manifesto = manifesto_particoes(title)
+    except DriveIndisponivel:
+        manifesto = _ultimos_manifestos().get(title, {}) if title in PARTICIONADAS else {}
+    mins = [info['min'] for info in manifesto.values() if info.get('min')]
+    maxs = [info['max'] for info in manifesto.values() if info.get('max')]
+    ini = date.fromisoformat(min(mins)) if mins else hoje
+    # lançamentos recentes podem estar só no journal: o período vai pelo menos até hoje
+    fim = max(date.fromisoformat(max(maxs)), hoje) if maxs else hoje
+    return [ini, fim]
+
+
+def _get_partition_file(title: str, mes: str):
+    # listagem fresca: a gravação condicional precisa do version/etag atual
+    return _get_latest_by_title(f"{mes}.csv", _partitions_folder_id(title), BASES[title], fresco=True)
+
+
+def _save_partition(file_obj, title: str, mes: str, df: pd.DataFrame, alteracoes, owner: str | None = None,
+                    journal: list | None = None):
+    # alteracoes: [(operacao, linhas)] registradas no backup incremental da partição;
+    # journal: entradas incorporadas (None mantém as já registradas em file_obj)
+    datas = pd.to_datetime(df['Data'], errors='coerce', format='%Y-%m-%d') if 'Data' in df.columns else pd.Series(dtype='datetime64[ns]')
+    journal = sorted(_journal_incorporado(file_obj)) if journal is None else journal
+    file_obj['description'] = json.dumps({
+        'linhas': int(len(df)),
+        'min': datas.min().strftime('%Y-%m-%d') if datas.notnull().any() else None,
+        'max': datas.max().strftime('%Y-%m-%d') if datas.notnull().any() else None,
+        **({'journal': journal} if journal else {}),
+    })
+    file_obj, dados = _save_csv_to_file(file_obj, df, base=title, condicional=True)
+    invalidar_cache_base(title, mes)
+    for operacao, linhas in alteracoes:
+        if not linhas.empty:
+            registrar_backup(title, operacao, linhas, file_obj.get('version'), dados, particao=mes, usuario=owner)
     return file_obj
 
 
-def salvar_backup(df: pd.DataFrame, base_title: str, revision: str | None):
-    drive = conectar_drive()
-    root_id = obter_pasta_ts_fiscal_id()
-    base_sem_ext = base_title.rsplit('.', 1)[0]
-    pasta_nome = f"Backup_{base_sem_ext}"
-    pasta_list = drive.ListFile({'q': f"'{root_id}' in parents and title='{pasta_nome}' and mimeType='application/vnd.google-apps.folder' and trashed=false"}).GetList()
-    if pasta_list:
-        backup_id = pasta_list[0]['id']
+def _insert_partition(title: str, mes: str, novos: pd.DataFrame, owner: str | None = None, journal=None):
+    # reaplicável: inserir de novo linhas já gravadas não muda nada (merge por ID).
+    # journal=(origem, vivas) na compactação: entrada de cada linha e ids listados no journal
+    file = _get_partition_file(title, mes)
+    df, _ = _read_csv_file(file)
+    incorporadas = None
+    if journal is not None:
+        origem, vivas = journal
+        anteriores = _journal_incorporado(file)
+        de = origem.loc[novos.index]
+        novos = novos[~de.isin(anteriores)]
+        incorporadas = _ids_journal(anteriores, de, vivas)
+    _save_partition(file, title, mes, _merge_rows(df, novos), [("insert", novos)], owner, incorporadas)
+    return True
+
+
+def _append_partitioned(title: str, df_new: pd.DataFrame, owner: str | None = None, journal=None):
+    if 'Data' in df_new.columns:
+        meses = _partition_key(df_new['Data'])
     else:
-        p = drive.CreateFile({'title': pasta_nome, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [{'id': root_id}]})
-        p.Upload()
-        backup_id = p['id']
-    ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-    rev = f"rev-{revision}" if revision else "rev-unknown"
-    fname = f"{base_sem_ext}__{ts}__{rev}.csv"
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".csv").name
-    df.to_csv(tmp, sep=CSV_SEP, index=False, encoding=CSV_ENC)
-    arq = drive.CreateFile({'title': fname, 'parents': [{'id': backup_id}]})
-    arq.SetContentFile(tmp)
-    arq.Upload()
+        meses = pd.Series(PARTICAO_SEM_DATA, index=df_new.index)
+    for mes, df_mes in df_new.groupby(meses):
+        # uma escrita por mês; se um mês falhar, repetir o envio é seguro pelo merge por ID
+        if not _executar_escrita([f"{title}@{mes}"], lambda m=mes, novos=df_mes: _insert_partition(title, m, novos, owner, journal),
+                                 owner, avisar=False):
+            return False
+    return True
 
-# ---------- Operações de escrita seguras ----------
 
-def append_rows(title: str, df_new: pd.DataFrame):
-    lock = DriveLock(title)
+def _migrate_to_partitions(title: str):
+    # primeira leitura com o particionamento ativo: divide a base monolítica por mês.
+    # Um mês por vez, renovando o lease a cada um; o marcador só é gravado no fim, então uma
+    # migração interrompida é retomada por quem ler depois (refazer um mês é seguro pelo merge por ID)
+    lock = criar_lock(title, owner="particionamento")
     if not lock.acquire():
-        st.error("Sistema ocupado. Tente novamente em alguns segundos.")
         return False
     try:
-        file = _get_latest_by_title(title)
-        df_cur, meta = _read_csv_file(file)
-        # alinhar colunas
-        all_cols = sorted(set(df_cur.columns).union(df_new.columns))
-        df_cur = df_cur.reindex(columns=all_cols)
-        df_new = df_new.reindex(columns=all_cols)
-        df_merged = pd.concat([df_cur, df_new], ignore_index=True)
-        if 'ID' in df_merged.columns:
-            df_merged = df_merged.drop_duplicates(subset=['ID'], keep='last')
-        file = _save_csv_to_file(file, df_merged)
-        salvar_backup(df_merged, title, file.get('version'))
+        pasta = _partitions_folder_id(title)
+        if PARTICAO_MARCADOR in _folder_children(pasta, fresco=True):
+            return True  # outro processo já migrou
+        legado = _find_by_title(title, fresco=True)
+        if legado is not None:
+            df, _ = _read_csv_file(legado)
+            meses = _partition_key(df['Data']) if 'Data' in df.columns else pd.Series(PARTICAO_SEM_DATA, index=df.index)
+            for mes, df_mes in df.groupby(meses):
+                if not lock.renovar():
+                    return False
+                if not _executar_escrita([f"{title}@{mes}"], lambda m=mes, novos=df_mes: _insert_partition(title, m, novos, "particionamento"),
+                                         "particionamento", avisar=False):
+                    return False
+            # mantém a base antiga renomeada, fora do caminho de leitura/escrita
+            legado['title'] = f"{title.rsplit('.', 1)[0]}__pre_particionamento.csv"
+            _upload_bytes(legado, None)
+        # sem base monolítica (base nova ou migrada antes do marcador existir) não há o que dividir
+        _upload_bytes({'title': PARTICAO_MARCADOR, 'parents': [{'id': pasta}],
+                       'description': json.dumps({'concluida': datetime.now().isoformat()})},
+                      b"{}", "application/json")
         return True
     finally:
         lock.release()
 
 
-def update_row_by_id(title: str, row_id: str, updates: dict):
-    lock = DriveLock(title)
-    if not lock.acquire():
-        st.error("Sistema ocupado. Tente novamente em alguns segundos.")
+def _locate_partitions(title: str, row_ids, datas_atuais: dict | None = None):
+    # {ID: mês}; os meses das dicas (Data atual dos registros) são varridos primeiro
+    manifesto = manifesto_particoes(title)
+    dicas = [d for d in (datas_atuais or {}).values() if d is not None and pd.notnull(d)]
+    primeiros = set(_partition_key(pd.Series(dicas)).unique()) & set(manifesto) if dicas else set()
+    pendentes = set(row_ids)
+    locais = {}
+    for mes in sorted(primeiros) + sorted(set(manifesto) - primeiros):
+        if not pendentes:
+            break
+        df = _load_cached(title, mes, manifesto[mes]['file'])
+        if 'ID' not in df.columns:
+            continue
+        achados = pendentes.intersection(df['ID'])
+        locais.update(dict.fromkeys(achados, mes))
+        pendentes -= achados
+    return locais
+
+
+def _avisar_nao_encontrados(n: int):
+    if n == 1:
+        st.error("Registro não encontrado. Recarregue a página.")
+    else:
+        st.error(f"{n} registros não encontrados. Recarregue a página.")
+
+
+def _aplicar_updates(df: pd.DataFrame, updates_por_id: dict):
+    # updates_por_id: {ID: {coluna: valor}}; altera df no lugar e devolve a máscara das linhas tocadas
+    for coluna in {k for u in updates_por_id.values() for k in u if k in df.columns}:
+        valores = {rid: u[coluna] for rid, u in updates_por_id.items() if coluna in u}
+        alvo = df['ID'].isin(list(valores))
+        df.loc[alvo, coluna] = df.loc[alvo, 'ID'].map(valores)
+    return df['ID'].isin(list(updates_por_id))
+
+
+def _compactar_antes_de_alterar(title: str):
+    # os registros podem ainda estar só no journal: sem a compactação a alteração não os
+    # acharia (ou seria desfeita por eles), então não segue. Entradas incorporadas cuja
+    # exclusão falhou não atrapalham: a partição as registra e elas são ignoradas
+    if title not in JOURNAL_BASES or compactar_journal(title, owner=st.session_state.username):
+        return True
+    st.error("Não foi possível incorporar os lançamentos recentes à base. Nada foi alterado; tente novamente.")
+    return False
+
+
+def _update_partitioned(title: str, updates_por_id: dict, datas_atuais: dict | None = None):
+    if not _compactar_antes_de_alterar(title):
         return False
-    try:
-        file = _get_latest_by_title(title)
+    origens = _locate_partitions(title, updates_por_id, datas_atuais)
+    if len(origens) < len(updates_por_id):
+        _avisar_nao_encontrados(len(updates_por_id) - len(origens))
+        return False
+    destinos = dict(origens)
+    novas_datas = pd.Series({rid: u['Data'] for rid, u in updates_por_id.items() if 'Data' in u}, dtype=object)
+    if not novas_datas.empty:
+        destinos.update(_partition_key(novas_datas).to_dict())
+    por_origem = {}
+    for rid, mes in origens.items():
+        por_origem.setdefault(mes, []).append(rid)
+
+    def _atualizar():
+        for origem, ids in sorted(por_origem.items()):
+            file = _get_partition_file(title, origem)
+            df, meta = _read_csv_file(file)
+            if 'ID' not in df.columns:
+                continue
+            mask = _aplicar_updates(df, {rid: updates_por_id[rid] for rid in ids})
+            if not mask.any():
+                continue  # já movidos numa tentativa anterior
+            saem = mask & (df['ID'].map(destinos) != origem)
+            movidos = df[saem]
+            # grava os destinos antes de remover da origem: o registro nunca some da base
+            for destino, grupo in movidos.groupby(movidos['ID'].map(destinos)):
+                _insert_partition(title, destino, grupo)
+            _save_partition(file, title, origem, df[~saem], [("update", df[mask & ~saem]), ("delete", movidos)])
+        return True
+
+    nomes = {f"{title}@{mes}" for mes in [*origens.values(), *destinos.values()]}
+    return _executar_escrita(nomes, _atualizar)
+
+
+def _delete_partitioned(title: str, row_ids, datas_atuais: dict | None = None):
+    if not _compactar_antes_de_alterar(title):
+        return False
+    locais = _locate_partitions(title, row_ids, datas_atuais)
+    if len(locais) < len(set(row_ids)):
+        _avisar_nao_encontrados(len(set(row_ids)) - len(locais))
+        return False
+    por_mes = {}
+    for rid, mes in locais.items():
+        por_mes.setdefault(mes, []).append(rid)
+
+    def _excluir():
+        for mes, ids in sorted(por_mes.items()):
+            file = _get_partition_file(title, mes)
+            df, meta = _read_csv_file(file)
+            removidos = df[df['ID'].isin(ids)] if 'ID' in df.columns else df.iloc[0:0]
+            if removidos.empty:
+                continue  # já removidos numa tentativa anterior
+            _save_partition(file, title, mes, df.drop(removidos.index), [("delete", removidos)])
+        return True
+
+    return _executar_escrita({f"{title}@{mes}" for mes in por_mes}, _excluir)
+
+# ---------- Operações de escrita seguras ----------
+
+def _merge_rows(df_cur: pd.DataFrame, df_new: pd.DataFrame):
+    # alinhar colunas
+    all_cols = sorted(set(df_cur.columns).union(df_new.columns))
+    df_cur = df_cur.reindex(columns=all_cols)
+    df_new = df_new.reindex(columns=all_cols)
+    df_merged = pd.concat([df_cur, df_new], ignore_index=True)
+    if 'ID' in df_merged.columns:
+        df_merged = df_merged.drop_duplicates(subset=['ID'], keep='last')
+    return df_merged
+
+
+@_medir_chamadas("append_rows")
+def append_rows(title: str, df_new: pd.DataFrame, owner: str | None = None):
+    if "Minutos" in BASES.get(title, []):
+        df_new = completar_minutos(df_new.copy())
+    if title in JOURNAL_BASES:
+        return _append_journal(title, df_new)
+    if title in PARTICIONADAS:
+        if not _append_partitioned(title, df_new, owner):
+            st.error("Sistema ocupado. Tente novamente em alguns segundos.")
+            return False
+        return True
+
+    def _inserir():
+        file = _get_latest_by_title(title, fresco=True)
+        df_cur, meta = _read_csv_file(file)
+        file, dados = _save_csv_to_file(file, _merge_rows(df_cur, df_new), condicional=True)
+        invalidar_cache_base(title)
+        registrar_backup(title, "insert", df_new, file.get('version'), dados, usuario=owner)
+        return True
+
+    return _executar_escrita([title], _inserir, owner)
+
+
+@_medir_chamadas("update_rows_by_id")
+def update_rows_by_id(title: str, updates_por_id: dict, datas_atuais: dict | None = None):
+    # updates_por_id: {ID: {coluna: valor}}; datas_atuais: {ID: Data atual}, dica das partições.
+    # Uma reescrita por objeto (base ou partição) para o lote inteiro
+    if not updates_por_id:
+        return True
+    if "Minutos" in BASES.get(title, []):
+        # Minutos acompanha Horas Gastas
+        updates_por_id = {
+            rid: {**u, "Minutos": minutos_horas(u["Horas Gastas"])} if "Horas Gastas" in u and "Minutos" not in u else u
+            for rid, u in updates_por_id.items()
+        }
+    if title in PARTICIONADAS:
+        return _update_partitioned(title, updates_por_id, datas_atuais)
+
+    def _atualizar():
+        file = _get_latest_by_title(title, fresco=True)
         df, meta = _read_csv_file(file)
+        df, journal_lido, df_journal = _fold_journal(title, df, file)
         if 'ID' not in df.columns:
             st.error("Base sem coluna ID. Não é possível editar com segurança.")
             return False
-        mask = df['ID'] == row_id
-        if not mask.any():
-            st.error("Registro não encontrado. Recarregue a página.")
+        faltando = set(updates_por_id) - set(df['ID'])
+        if faltando:
+            _avisar_nao_encontrados(len(faltando))
             return False
-        for k, v in updates.items():
-            if k in df.columns:
-                df.loc[mask, k] = v
-        file = _save_csv_to_file(file, df)
-        salvar_backup(df, title, file.get('version'))
+        mask = _aplicar_updates(df, updates_por_id)
+        file, dados = _save_csv_to_file(file, df, condicional=True)
+        _delete_journal_entries(title, journal_lido)
+        invalidar_cache_base(title)
+        if journal_lido:
+            registrar_backup(title, "insert", df_journal, file.get('version'), dados)
+        registrar_backup(title, "update", df[mask], file.get('version'), dados)
         return True
-    finally:
-        lock.release()
 
+    return _executar_escrita([title], _atualizar)
 
-def delete_row_by_id(title: str, row_id: str):
-    lock = DriveLock(title)
-    if not lock.acquire():
-        st.error("Sistema ocupado. Tente novamente em alguns segundos.")
-        return False
-    try:
-        file = _get_latest_by_title(title)
+
+@_medir_chamadas("update_row_by_id")
+def update_row_by_id(title: str, row_id: str, updates: dict, data_atual=None):
+    # data_atual: Data atual do registro, usada como dica da partição em bases particionadas
+    return update_rows_by_id(title, {row_id: updates}, {row_id: data_atual})
+
+
+@_medir_chamadas("delete_rows_by_id")
+def delete_rows_by_id(title: str, row_ids, datas_atuais: dict | None = None):
+    if not len(row_ids):
+        return True
+    if title in PARTICIONADAS:
+        return _delete_partitioned(title, row_ids, datas_atuais)
+
+    def _excluir():
+        file = _get_latest_by_title(title, fresco=True)
         df, meta = _read_csv_file(file)
+        df, journal_lido, df_journal = _fold_journal(title, df, file)
         if 'ID' not in df.columns:
             st.error("Base sem coluna ID. Não é possível excluir com segurança.")
             return False
-        before = len(df)
-        df = df[df['ID'] != row_id]
-        after = len(df)
-        if before == after:
-            st.error("Registro não encontrado. Recarregue a página.")
+        faltando = set(row_ids) - set(df['ID'])
+        if faltando:
+            _avisar_nao_encontrados(len(faltando))
             return False
-        file = _save_csv_to_file(file, df)
-        salvar_backup(df, title, file.get('version'))
+        removidos = df[df['ID'].isin(list(row_ids))]
+        file, dados = _save_csv_to_file(file, df.drop(removidos.index), condicional=True)
+        _delete_journal_entries(title, journal_lido)
+        invalidar_cache_base(title)
+        if journal_lido:
+            registrar_backup(title, "insert", df_journal, file.get('version'), dados)
+        registrar_backup(title, "delete", removidos, file.get('version'), dados)
         return True
-    finally:
-        lock.release()
 
-# =============================================
-# TRATAMENTO DE CAMPOS
-# =============================================
+    return _executar_escrita([title], _excluir)
 
-def gerar_id_unico():
-    return str(uuid.uuid4())
 
+@_medir_chamadas("delete_row_by_id")
+def delete_row_by_id(title: str, row_id: str, data_atual=None):
+    return delete_rows_by_id(title, [row_id], {row_id: data_atual})
 
-def formatar_horas(horas_input):
-    if horas_input is None or str(horas_input).strip() == "":
-        return None
-    horas_input = str(horas_input).strip().replace(",", ".")
-    pattern = re.fullmatch(r"(\d{1,2})[:;.,](\d{1,2})", horas_input)
-    if pattern:
-        h, m = map(int, pattern.groups())
-        if 0 <= h < 24 and 0 <= m < 60:
-            return f"{h:02d}:{m:02d}"
-    try:
-        decimal = float(horas_input)
-        total_min = int(round(decimal * 60))
-        h = total_min // 60
-        m = total_min % 60
-        return f"{h:02d}:{m:02d}"
-    except Exception:
-        return None
 
+def importar_linhas(title: str, df_new: pd.DataFrame, owner: str | None = None):
+    # carga em massa: em bases particionadas grava direto nas partições (sem journal), um mês
+    # por escrita; nas demais, em lotes de IMPORTACAO_LOTE_LINHAS. Gera (lote, total, linhas, ok)
+    # para a barra de progresso; repetir um lote é seguro (merge por ID). As linhas vão
+    # tipadas como as da base (texto das dimensões, inteiros, Minutos)
+    df_new = tipar_base(title, df_new.copy())
+    if title in PARTICIONADAS and 'Data' in df_new.columns:
+        lotes = [df for _, df in df_new.groupby(_partition_key(df_new['Data']))]
+    else:
+        lotes = [df_new.iloc[i:i + IMPORTACAO_LOTE_LINHAS] for i in range(0, len(df_new), IMPORTACAO_LOTE_LINHAS)]
+    for n, lote in enumerate(lotes, 1):
+        if title in PARTICIONADAS:
+            ok = _append_partitioned(title, lote, owner)
+        else:
+            ok = append_rows(title, lote, owner)
+        yield n, len(lotes), len(lote), ok
+
+
+def preencher_minutos(title: str, owner: str = "minutos"):
+    # preenchimento único da coluna Minutos nas linhas gravadas antes dela: reescreve só
+    # as partições (ou a base) que ainda têm linhas a completar; _save_csv_to_file completa
+    if title in PARTICIONADAS:
+        alvos = [(mes, f"{title}@{mes}", lambda m=mes: _get_partition_file(title, m)) for mes in manifesto_particoes(title)]
+    else:
+        alvos = [(None, title, lambda: _get_latest_by_title(title, fresco=True))]
+    ok = True
+    for mes, nome_lock, obter_arquivo in alvos:
+        def _preencher(mes=mes, obter_arquivo=obter_arquivo):
+            file = obter_arquivo()
+            df, _ = _read_csv_file(file)
+            antes = df["Minutos"].notna() if "Minutos" in df.columns else None
+            df = completar_minutos(df)
+            preenchidas = df["Minutos"].notna() & (~antes if antes is not None else True)
+            if antes is not None and not preenchidas.any():
+                return True
+            file, dados = _save_csv_to_file(file, df, base=title, condicional=True)
+            invalidar_cache_base(title, mes)
+            registrar_backup(title, "update", df[preenchidas], file.get('version'), dados, particao=mes, usuario=owner)
+            return True
+        ok = bool(_executar_escrita([nome_lock], _preencher, owner, avisar=False)) and ok
+    return ok
+
+
+@st.cache_resource(show_spinner=False)
+def _preenchimentos_minutos():
+    # bases já preenchidas (ou em preenchimento) neste processo
+    return {"lock": threading.Lock(), "bases": set()}
+
+
+def agendar_preenchimento_minutos(title: str):
+    # uma vez por base por processo, em segundo plano; se falhar, a próxima leitura reagenda
+    estado = _preenchimentos_minutos()
+    with estado["lock"]:
+        if title in estado["bases"]:
+            return
+        estado["bases"].add(title)
+
+    def _executar():
+        try:
+            ok = preencher_minutos(title)
+        except Exception:
+            ok = False
+        if not ok:
+            with estado["lock"]:
+                estado["bases"].discard(title)
+
+    threading.Thread(target=_executar, name=f"minutos-{title}", daemon=True).start()
+
+# ---------- Fila de gravação (write-behind) ----------
+
+@st.cache_resource(show_spinner=False)
+def _fila_escrita():
+    # pendentes: base -> [(ticket, df)]; tickets: ticket -> status do envio
+    return {"cond": threading.Condition(), "pendentes": {}, "tickets": {}, "worker": None}
+
+
+def enfileirar_linhas(title: str, df_new: pd.DataFrame):
+    # devolve o ticket do envio; o status vira "gravado" só depois que o lote está no armazenamento
+    fila = _fila_escrita()
+    ticket = gerar_id_unico()
+    with fila["cond"]:
+        fila["tickets"][ticket] = {"status": "pendente", "base": title, "linhas": len(df_new),
+                                   "criado": time.time(), "concluido": None, "lote": None, "erro": None}
+        fila["pendentes"].setdefault(title, []).append((ticket, df_new))
+        if fila["worker"] is None or not fila["worker"].is_alive():
+            fila["worker"] = threading.Thread(target=_processar_fila, args=(fila,), name="fila-escrita", daemon=True)
+            fila["worker"].start()
+        fila["cond"].notify_all()
+    return ticket
+
+
+def status_ticket(ticket: str):
+    fila = _fila_escrita()
+    with fila["cond"]:
+        info = fila["tickets"].get(ticket)
+        return dict(info) if info else None
+
+
+def aguardar_ticket(ticket: str, timeout: float):
+    fila = _fila_escrita()
+    fim = time.time() + timeout
+    with fila["cond"]:
+        while fila["tickets"].get(ticket, {}).get("status") == "pendente":
+            restante = fim - time.time()
+            if restante <= 0:
+                break
+            fila["cond"].wait(restante)
+        info = fila["tickets"].get(ticket)
+        return dict(info) if info else None
+
+
+def _gravar_lote(title: str, df_lote: pd.DataFrame):
+    erro = None
+    for tentativa in range(FILA_TENTATIVAS):
+        try:
+            if append_rows(title, df_lote, owner="fila-escrita"):
+                return None
+            erro = "Sistema ocupado"
+        except Exception as e:
+            erro = str(e)
+        if tentativa + 1 < FILA_TENTATIVAS:
+            time.sleep(LOCK_BACKOFF_INICIAL_SEG * 2 ** tentativa)
+    return erro
+
+
+def _processar_fila(fila):
+    # um worker por processo: espera a janela, junta tudo o que chegou e grava um lote por base
+    while True:
+        with fila["cond"]:
+            while not fila["pendentes"]:
+                fila["cond"].wait()
+        time.sleep(FILA_JANELA_SEG)
+        with fila["cond"]:
+            lotes, fila["pendentes"] = fila["pendentes"], {}
+        for title, itens in lotes.items():
+            erro = _gravar_lote(title, pd.concat([df for _, df in itens], ignore_index=True))
+            with fila["cond"]:
+                agora = time.time()
+                for ticket, _ in itens:
+                    fila["tickets"][ticket].update(status="erro" if erro else "gravado", erro=erro,
+                                                   lote=len(itens), concluido=agora)
+                # esquece tickets concluídos há mais de uma hora
+                for ticket in [t for t, i in fila["tickets"].items() if i["concluido"] and agora - i["concluido"] > 3600]:
+                    del fila["tickets"][ticket]
+                fila["cond"].notify_all()
+
+# =============================================
+# TRATAMENTO DE CAMPOS
+# =============================================
 
 def normalizar_coluna_horas(df, coluna="Horas Gastas"):
     if coluna in df.columns:
-        df[coluna] = df[coluna].astype(str).apply(formatar_horas)
+        df[coluna], _ = interpretar_horas(df[coluna])
     return df
 
 
 def tratar_coluna_data(df, coluna="Data"):
     if coluna in df.columns:
-        parsed = pd.to_datetime(df[coluna], errors="coerce", format="%Y-%m-%d")
+        if pd.api.types.is_datetime64_any_dtype(df[coluna]):
+            parsed = df[coluna]
+        else:
+            parsed = pd.to_datetime(df[coluna], errors="coerce", format="%Y-%m-%d")
         df["DataValida"] = parsed.notnull()
         df[coluna] = parsed
     return df
 
+
+def tipar_base(title: str, df: pd.DataFrame):
+    # tipos usados pelo snapshot e entregues por carregar_base: Data datetime64,
+    # Quantidade e Minutos inteiros, Horas Gastas em HH:MM, dimensões categóricas e
+    # textos longos (ID, Observações, DataHoraLancamento) em string do Arrow (um buffer
+    # contíguo em vez de um objeto por célula). Idempotente e barata numa base já tipada
+    if title == "timesheet.csv":
+        df = completar_minutos(df)
+        if "Data" in df.columns:
+            df["Data"] = pd.to_datetime(df["Data"], errors="coerce", format="%Y-%m-%d")
+        if "Quantidade" in df.columns:
+            df["Quantidade"] = pd.to_numeric(df["Quantidade"], errors="coerce").round().astype("Int64")
+        for coluna in COLUNAS_CATEGORICAS_TS:
+            if coluna in df.columns and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+                # sempre texto: o CSV lê códigos como 1000 (int) e a importação manda "1000";
+                # categorias de tipos misturados não vão para o Parquet
+                df[coluna] = texto_coluna(df[coluna]).astype("category")
+        if PARQUET_DISPONIVEL:
+            for coluna in ("ID", "Observações", "DataHoraLancamento"):
+                if coluna in df.columns:
+                    df[coluna] = df[coluna].astype("string[pyarrow]")
+    return df
+
+
+# =============================================
+# CONSULTAS DO DASHBOARD (DuckDB com fallback em pandas)
+# =============================================
+
+# dimensão do gráfico -> coluna agrupada; "Dia" é Data truncada
+DIMENSOES_DASHBOARD = ["Projeto", "Time", "Atividade", "Empresa", "Nome", "Dia"]
+
+# ---------- Filtros (Dashboard e Visualizar) ----------
+# filtros = {coluna: [valores]}: cada dimensão aceita vários valores; lista vazia = todos
+
+def mascara_filtros(df: pd.DataFrame, periodo=None, filtros: dict | None = None):
+    # uma máscara NumPy para todos os filtros, aplicada uma vez por quem chama: o período
+    # compara datetime64 (sem criar um date por linha) e as categóricas comparam códigos
+    mask = np.ones(len(df), dtype=bool)
+    if periodo is not None:
+        datas = df["Data"].to_numpy(dtype="datetime64[ns]")
+        mask &= datas >= np.datetime64(periodo[0], "ns")
+        mask &= datas < np.datetime64(periodo[1] + timedelta(days=1), "ns")
+    for coluna, valores in (filtros or {}).items():
+        if not valores:
+            continue
+        serie = df[coluna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            codigos = serie.cat.categories.get_indexer(list(valores))
+            mask &= np.isin(serie.cat.codes.to_numpy(), codigos[codigos >= 0])
+        else:
+            mask &= serie.isin(valores).to_numpy()
+    return mask
+
+
+def filtros_barra_lateral(df: pd.DataFrame, colunas: list):
+    # um multiselect por dimensão, com as opções presentes em df; devolve só os preenchidos
+    todas = {"Empresa", "Atividade"}
+    filtros = {}
+    for coluna in colunas:
+        opcoes = sorted(df[coluna].dropna().unique().tolist()) if coluna in df.columns else []
+        valores = st.sidebar.multiselect(f"{coluna}:", opcoes, placeholder="Todas" if coluna in todas else "Todos")
+        if valores:
+            filtros[coluna] = valores
+    return filtros
+
+
+def _agregar_duckdb(df: pd.DataFrame, periodo, filtros: dict):
+    # uma consulta só: filtros no WHERE e todas as quebras via GROUPING SETS;
+    # o conjunto vazio () traz os KPIs gerais
+    where = ["Data IS NOT NULL", "CAST(Data AS DATE) BETWEEN ? AND ?"]
+    params = [periodo[0], periodo[1]]
+    for coluna, valores in filtros.items():
+        if valores:
+            where.append(f'"{coluna}" IN ({", ".join("?" * len(valores))})')
+            params.extend(valores)
+    conjuntos = ", ".join(f'("{d}")' for d in DIMENSOES_DASHBOARD)
+    sql = f"""
+        SELECT {", ".join(f'"{d}"' for d in DIMENSOES_DASHBOARD)},
+               GROUPING({", ".join(f'"{d}"' for d in DIMENSOES_DASHBOARD)}) AS grupo,
+               COALESCE(SUM(Minutos), 0) / 60.0 AS Horas, COALESCE(SUM(Registros), 0) AS registros,
+               COUNT(DISTINCT Nome) AS colaboradores, COUNT(DISTINCT Projeto) AS projetos
+        FROM (SELECT *, CAST(Data AS DATE) AS Dia FROM ts)
+        WHERE {" AND ".join(where)}
+        GROUP BY GROUPING SETS ({conjuntos}, ())
+    """
+    con = duckdb.connect()
+    try:
+        con.register("ts", df[["Data", "Minutos", "Registros", "Empresa", "Projeto", "Time", "Atividade", "Nome"]])
+        res = con.execute(sql, params).df()
+    finally:
+        con.close()
+
+    n = len(DIMENSOES_DASHBOARD)
+    total = res[res["grupo"] == (1 << n) - 1]
+    resultado = {
+        "total_horas": float(total["Horas"].fillna(0).iloc[0]) if not total.empty else 0.0,
+        "total_registros": int(total["registros"].iloc[0]) if not total.empty else 0,
+        "total_colaboradores": int(total["colaboradores"].iloc[0]) if not total.empty else 0,
+        "total_projetos": int(total["projetos"].iloc[0]) if not total.empty else 0,
+    }
+    for i, dim in enumerate(DIMENSOES_DASHBOARD):
+        # GROUPING() marca com 1 as colunas fora do conjunto; a dimensão ocupa o bit n-1-i
+        bits = ((1 << n) - 1) ^ (1 << (n - 1 - i))
+        g = res.loc[(res["grupo"] == bits) & res[dim].notna(), [dim, "Horas"]]
+        if dim == "Dia":
+            g[dim] = pd.to_datetime(g[dim]).dt.date
+        resultado[dim] = g.reset_index(drop=True)
+    return resultado
+
+
+def _agregar_pandas(df: pd.DataFrame, periodo, filtros: dict):
+    df_filtrado = df[mascara_filtros(df, periodo, filtros)]
+    df_filtrado = df_filtrado.assign(Dia=df_filtrado["Data"].dt.normalize())
+    resultado = {
+        "total_horas": float(df_filtrado["Minutos"].sum()) / 60,
+        "total_registros": int(df_filtrado["Registros"].sum()),
+        "total_colaboradores": df_filtrado["Nome"].nunique(),
+        "total_projetos": df_filtrado["Projeto"].nunique(),
+    }
+    for dim in DIMENSOES_DASHBOARD:
+        g = df_filtrado.groupby(dim, as_index=False, observed=True)["Minutos"].sum()
+        if dim == "Dia":
+            g[dim] = g[dim].dt.date
+        resultado[dim] = g.assign(Horas=g["Minutos"].astype(float) / 60)[[dim, "Horas"]]
+    return resultado
+
+
+def agregar_dashboard(df: pd.DataFrame, periodo, filtros: dict):
+    # df = linhas do cubo (carregar_cubo): Data datetime64 e Minutos/Registros já somados por
+    # dia × dimensões; filtros = {coluna: [valores]} só dos selecionados.
+    # Quebras voltam ordenadas por Horas (Dia em ordem cronológica)
+    resultado = None
+    if DUCKDB_DISPONIVEL:
+        try:
+            resultado = _agregar_duckdb(df, periodo, filtros)
+        except Exception:
+            resultado = None
+    if resultado is None:
+        resultado = _agregar_pandas(df, periodo, filtros)
+    for dim in DIMENSOES_DASHBOARD:
+        if dim == "Dia":
+            resultado[dim] = resultado[dim].sort_values(dim).reset_index(drop=True)
+        else:
+            resultado[dim] = resultado[dim].sort_values(by="Horas", ascending=False).reset_index(drop=True)
+    return resultado
+
+
+def graficos_dashboard(agg: dict):
+    graficos = {
+        "Projeto": px.bar(agg["Projeto"], x="Projeto", y="Horas", text_auto='.2s'),
+        "Time": px.bar(agg["Time"], x="Time", y="Horas", text_auto='.2s'),
+        "Atividade": px.bar(agg["Atividade"].head(), x="Atividade", y="Horas", text_auto='.2s'),
+        "Empresa": px.pie(agg["Empresa"], names="Empresa", values="Horas", hole=0.4),
+        "Nome": px.bar(agg["Nome"], x="Nome", y="Horas", text_auto='.2s'),
+        "Dia": px.line(agg["Dia"], x="Dia", y="Horas", markers=True),
+    }
+    graficos["Dia"].update_xaxes(title="Dia", type="category")
+    graficos["Dia"].update_yaxes(title="Horas")
+    return graficos
+
+
+@st.cache_resource(show_spinner=False)
+def _cache_dashboard():
+    # (versões da base, período, filtros) -> (agregações, gráficos), do menos ao mais recente
+    return {"lock": threading.Lock(), "itens": OrderedDict()}
+
+
+def painel_dashboard(df: pd.DataFrame, meta: dict, periodo, filtros: dict):
+    # agregar_dashboard + gráficos, memorizados: sessões com a mesma base e os mesmos filtros
+    # (ou uma volta ao Dashboard) reaproveitam o resultado, que é compartilhado e não deve
+    # ser alterado. Cópia só leitura (Drive indisponível) não tem versão: calcula sempre
+    if 'partes' not in meta:
+        agg = agregar_dashboard(df, periodo, filtros)
+        return agg, graficos_dashboard(agg)
+    chave = (meta['title'], tuple(sorted(meta['partes'].items(), key=str)), meta.get('journal', ()),
+             tuple(periodo), tuple(sorted((c, tuple(sorted(v, key=str))) for c, v in filtros.items() if v)))
+    cache = _cache_dashboard()
+    with cache["lock"]:
+        if chave in cache["itens"]:
+            cache["itens"].move_to_end(chave)
+            return cache["itens"][chave]
+    agg = agregar_dashboard(df, periodo, filtros)
+    resultado = (agg, graficos_dashboard(agg))
+    with cache["lock"]:
+        cache["itens"][chave] = resultado
+        cache["itens"].move_to_end(chave)
+        while len(cache["itens"]) > DASHBOARD_CACHE_MAX:
+            cache["itens"].popitem(last=False)
+    return resultado
+
 # =============================================
 # MENU LATERAL
 # =============================================
 
+if st.session_state.username in ADMIN_USERS:
+    with st.sidebar.expander("📡 Chamadas ao Drive por operação"):
+        st.dataframe(estatisticas_drive_df(), use_container_width=True, hide_index=True)
+        st.caption(f"Circuito do Drive: {estado_circuito_drive()}")
+    with st.sidebar.expander("🔒 Locks: espera e posse"):
+        st.dataframe(estatisticas_locks_df(), use_container_width=True, hide_index=True)
+    with st.sidebar.expander("💾 Memória do cache de bases"):
+        # medir percorre as células de texto: só sob demanda
+        if st.button("Medir memória"):
+            st.dataframe(memoria_cache_df(), use_container_width=True, hide_index=True)
+    with st.sidebar.expander("🗄️ Backups em segundo plano"):
+        backups_info = estado_backups()
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Pendentes", backups_info["pendentes"])
+        c2.metric("Concluídos", backups_info["concluidos"])
+        c3.metric("Falhas", len(backups_info["falhas"]))
+        if not backups_info["falhas"].empty:
+            st.dataframe(backups_info["falhas"], use_container_width=True, hide_index=True)
+
 st.sidebar.title("📋 Menu")
 menu = st.sidebar.radio("Navegar para:", [
     "🏠 Dashboard",
@@ -371,7 +2481,7 @@ menu = st.sidebar.radio("Navegar para:", [
     "📝 Lançamento de Timesheet",
     "📄 Visualizar / Editar Timesheet",
     "📊 Avaliação de Performance — IA"
-])
+] + (["📥 Importação em Lote"] if st.session_state.username in ADMIN_USERS else []))
 
 # =============================================
 # CONTEÚDO: DASHBOARD
@@ -379,90 +2489,45 @@ menu = st.sidebar.radio("Navegar para:", [
 
 if menu == "🏠 Dashboard":
     st.title("📊 Painel de KPIs do Timesheet")
-    df_timesheet, meta = carregar_base("timesheet.csv")
-    df_timesheet = normalizar_coluna_horas(df_timesheet)
-    df_timesheet = tratar_coluna_data(df_timesheet)
 
-    if df_timesheet.empty:
-        st.info("⚠️ Não há dados no timesheet para gerar dashboard.")
-        st.stop()
+    # Filtros (o período vem antes da carga: só os meses selecionados são baixados)
+    st.sidebar.subheader("🔍 Filtros")
+    data_inicial, data_final = st.sidebar.date_input("Período:", intervalo_base("timesheet.csv"))
 
-    def converter_para_horas(horas_str):
-        try:
-            h, m = map(int, str(horas_str).strip().split(":"))
-            return h + m / 60
-        except Exception:
-            return 0
+    # o Dashboard só lê o cubo (horas já somadas por dia × dimensões), não as linhas
+    df_ts, meta = carregar_cubo("timesheet.csv", periodo=(data_inicial, data_final))
 
-    df_ts = df_timesheet[df_timesheet.get("DataValida", True) == True].copy()
-    df_ts["Horas"] = df_ts["Horas Gastas"].apply(converter_para_horas)
+    if df_ts.empty:
+        st.info("⚠️ Não há dados no timesheet para gerar dashboard.")
+        st.stop()
 
-    # Filtros
-    st.sidebar.subheader("🔍 Filtros")
-    df_ts["Data"] = pd.to_datetime(df_ts["Data"], errors="coerce")
-    periodo_padrao = [
-        (df_ts["Data"].min().date() if not df_ts.empty else date.today()),
-        (df_ts["Data"].max().date() if not df_ts.empty else date.today())
-    ]
-    data_inicial, data_final = st.sidebar.date_input("Período:", periodo_padrao)
-
-    empresa = st.sidebar.selectbox("Empresa:", ["Todas"] + sorted(df_ts["Empresa"].dropna().unique().tolist()))
-    projeto = st.sidebar.selectbox("Projeto:", ["Todos"] + sorted(df_ts["Projeto"].dropna().unique().tolist()))
-    squad = st.sidebar.selectbox("Time:", ["Todos"] + sorted(df_ts["Time"].dropna().unique().tolist()))
-    atividade = st.sidebar.selectbox("Atividade:", ["Todas"] + sorted(df_ts["Atividade"].dropna().unique().tolist()))
-
-    df_filtrado = df_ts[(df_ts["Data"].dt.date >= data_inicial) & (df_ts["Data"].dt.date <= data_final)].copy()
-    if empresa != "Todas":
-        df_filtrado = df_filtrado[df_filtrado["Empresa"] == empresa]
-    if projeto != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Projeto"] == projeto]
-    if squad != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Time"] == squad]
-    if atividade != "Todas":
-        df_filtrado = df_filtrado[df_filtrado["Atividade"] == atividade]
-
-    total_horas = df_filtrado["Horas"].sum()
-    total_registros = len(df_filtrado)
-    total_colaboradores = df_filtrado["Nome"].nunique()
-    total_projetos = df_filtrado["Projeto"].nunique()
+    filtros = filtros_barra_lateral(df_ts, ["Empresa", "Projeto", "Time", "Atividade"])
+    agg, graficos = painel_dashboard(df_ts, meta, (data_inicial, data_final), filtros)
 
     c1, c2, c3, c4 = st.columns(4)
-    c1.metric("⏰ Total de Horas", f"{total_horas:.2f}")
-    c2.metric("📄 Total Registros", total_registros)
-    c3.metric("👤 Colaboradores", total_colaboradores)
-    c4.metric("🏗️ Projetos", total_projetos)
+    c1.metric("⏰ Total de Horas", f"{agg['total_horas']:.2f}")
+    c2.metric("📄 Total Registros", agg["total_registros"])
+    c3.metric("👤 Colaboradores", agg["total_colaboradores"])
+    c4.metric("🏗️ Projetos", agg["total_projetos"])
 
-    if not df_filtrado.empty:
+    if agg["total_registros"] > 0:
         st.subheader("🏗️ Horas por Projeto")
-        gp = df_filtrado.groupby("Projeto")["Horas"].sum().reset_index().sort_values(by="Horas", ascending=False)
-        st.plotly_chart(px.bar(gp, x="Projeto", y="Horas", text_auto='.2s'), use_container_width=True)
+        st.plotly_chart(graficos["Projeto"], use_container_width=True)
 
         st.subheader("🚀 Horas por Time")
-        gt = df_filtrado.groupby("Time")["Horas"].sum().reset_index().sort_values(by="Horas", ascending=False)
-        st.plotly_chart(px.bar(gt, x="Time", y="Horas", text_auto='.2s'), use_container_width=True)
+        st.plotly_chart(graficos["Time"], use_container_width=True)
 
         st.subheader("🗒️ Horas por Atividade")
-        ga = df_filtrado.groupby("Atividade")["Horas"].sum().reset_index().sort_values(by="Horas", ascending=False)
-        st.plotly_chart(px.bar(ga.head(), x="Atividade", y="Horas", text_auto='.2s'), use_container_width=True)
+        st.plotly_chart(graficos["Atividade"], use_container_width=True)
 
         st.subheader("🏢 Horas por Empresa")
-        ge = df_filtrado.groupby("Empresa")["Horas"].sum().reset_index().sort_values(by="Horas", ascending=False)
-        st.plotly_chart(px.pie(ge, names="Empresa", values="Horas", hole=0.4), use_container_width=True)
+        st.plotly_chart(graficos["Empresa"], use_container_width=True)
 
         st.subheader("👤 Horas por Colaborador")
-        gc = df_filtrado.groupby("Nome")["Horas"].sum().reset_index().sort_values(by="Horas", ascending=False)
-        st.plotly_chart(px.bar(gc, x="Nome", y="Horas", text_auto='.2s'), use_container_width=True)
+        st.plotly_chart(graficos["Nome"], use_container_width=True)
 
         st.subheader("📅 Evolução de Horas no Tempo (Por Dia)")
-        gt = (
-            df_filtrado.assign(Dia=df_filtrado["Data"].dt.date)
-            .groupby("Dia", as_index=False)["Horas"].sum()
-            .sort_values("Dia")
-        )
-        fig = px.line(gt, x="Dia", y="Horas", markers=True)
-        fig.update_xaxes(title="Dia", type="category")
-        fig.update_yaxes(title="Horas")
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(graficos["Dia"], use_container_width=True)
 
 # =============================================
 # CONTEÚDO: EMPRESAS
@@ -523,31 +2588,17 @@ elif menu == "🏢 Cadastro de Empresas":
                             pass
                         # Como empresas não tem ID no seu legado, fazemos overwrite seguro com append_rows refazendo a base
                         # Estratégia simples: montar base inteira e salvar via _save_csv_to_file
-                        lock = DriveLock("empresas.csv")
-                        if lock.acquire():
-                            try:
-                                file = _get_latest_by_title("empresas.csv")
-                                _save_csv_to_file(file, df_empresas)
-                                salvar_backup(df_empresas, "empresas.csv", file.get('version'))
-                                st.success("✅ Empresa atualizada!")
-                                st.rerun()
-                            finally:
-                                lock.release()
+                        if regravar_base("empresas.csv", df_empresas):
+                            st.success("✅ Empresa atualizada!")
+                            st.rerun()
             with cols[1]:
                 if st.button("🗑️ Excluir Empresa"):
                     confirmar = st.radio("⚠️ Confirmar exclusão?", ["Não", "Sim"], horizontal=True, key="conf_emp")
                     if confirmar == "Sim":
                         df_empresas = df_empresas[df_empresas["Codigo SAP"].astype(str) != str(empresa_sel)]
-                        lock = DriveLock("empresas.csv")
-                        if lock.acquire():
-                            try:
-                                file = _get_latest_by_title("empresas.csv")
-                                _save_csv_to_file(file, df_empresas)
-                                salvar_backup(df_empresas, "empresas.csv", file.get('version'))
-                                st.success("✅ Empresa excluída!")
-                                st.rerun()
-                            finally:
-                                lock.release()
+                        if regravar_base("empresas.csv", df_empresas):
+                            st.success("✅ Empresa excluída!")
+                            st.rerun()
     else:
         st.info("🚩 Nenhuma empresa cadastrada até o momento.")
 
@@ -559,7 +2610,8 @@ elif menu == "🗂️ Cadastro de Projetos e Atividades":
     st.title("🗂️ Cadastro de Projetos e Atividades")
     st.markdown("## 🏗️ Projetos")
 
-    df_projetos, _ = carregar_base("projetos.csv")
+    bases = carregar_bases("projetos.csv", "atividades.csv")
+    df_projetos, _ = bases["projetos.csv"]
 
     with st.form("form_projeto"):
         nome_projeto = st.text_input("Nome do Projeto")
@@ -597,36 +2649,22 @@ elif menu == "🗂️ Cadastro de Projetos e Atividades":
                     df_projetos.loc[idx, "Nome Projeto"] = novo_nome.strip()
                     df_projetos.loc[idx, "Time"] = nova_desc.strip()
                     df_projetos.loc[idx, "Status"] = novo_status
-                    lock = DriveLock("projetos.csv")
-                    if lock.acquire():
-                        try:
-                            file = _get_latest_by_title("projetos.csv")
-                            _save_csv_to_file(file, df_projetos)
-                            salvar_backup(df_projetos, "projetos.csv", file.get('version'))
-                            st.success("✅ Projeto atualizado!")
-                            st.rerun()
-                        finally:
-                            lock.release()
+                    if regravar_base("projetos.csv", df_projetos):
+                        st.success("✅ Projeto atualizado!")
+                        st.rerun()
             with c2:
                 if st.button("🗑️ Excluir Projeto"):
                     confirmar = st.radio("⚠️ Confirmar Exclusão?", ["Não", "Sim"], horizontal=True)
                     if confirmar == "Sim":
                         df_projetos = df_projetos.drop(idx)
-                        lock = DriveLock("projetos.csv")
-                        if lock.acquire():
-                            try:
-                                file = _get_latest_by_title("projetos.csv")
-                                _save_csv_to_file(file, df_projetos)
-                                salvar_backup(df_projetos, "projetos.csv", file.get('version'))
-                                st.success("✅ Projeto excluído!")
-                                st.rerun()
-                            finally:
-                                lock.release()
+                        if regravar_base("projetos.csv", df_projetos):
+                            st.success("✅ Projeto excluído!")
+                            st.rerun()
 
     # ATIVIDADES
     st.markdown("---")
     st.markdown("## 🗒️ Atividades")
-    df_atividades, _ = carregar_base("atividades.csv")
+    df_atividades, _ = bases["atividades.csv"]
 
     with st.form("form_atividade"):
         nome_atividade = st.text_input("Nome da Atividade")
@@ -668,31 +2706,17 @@ elif menu == "🗂️ Cadastro de Projetos e Atividades":
                     df_atividades.loc[idx, "Projeto Vinculado"] = novo_proj.strip()
                     df_atividades.loc[idx, "Descrição"] = nova_desc.strip()
                     df_atividades.loc[idx, "Status"] = novo_status
-                    lock = DriveLock("atividades.csv")
-                    if lock.acquire():
-                        try:
-                            file = _get_latest_by_title("atividades.csv")
-                            _save_csv_to_file(file, df_atividades)
-                            salvar_backup(df_atividades, "atividades.csv", file.get('version'))
-                            st.success("✅ Atividade atualizada!")
-                            st.rerun()
-                        finally:
-                            lock.release()
+                    if regravar_base("atividades.csv", df_atividades):
+                        st.success("✅ Atividade atualizada!")
+                        st.rerun()
             with c2:
                 if st.button("🗑️ Excluir Atividade"):
                     confirmar = st.radio("⚠️ Confirmar Exclusão?", ["Não", "Sim"], horizontal=True)
                     if confirmar == "Sim":
                         df_atividades = df_atividades.drop(idx)
-                        lock = DriveLock("atividades.csv")
-                        if lock.acquire():
-                            try:
-                                file = _get_latest_by_title("atividades.csv")
-                                _save_csv_to_file(file, df_atividades)
-                                salvar_backup(df_atividades, "atividades.csv", file.get('version'))
-                                st.success("✅ Atividade excluída!")
-                                st.rerun()
-                            finally:
-                                lock.release()
+                        if regravar_base("atividades.csv", df_atividades):
+                            st.success("✅ Atividade excluída!")
+                            st.rerun()
 
 # =============================================
 # CONTEÚDO: LANÇAMENTO TS
@@ -705,60 +2729,169 @@ elif menu == "📝 Lançamento de Timesheet":
     usuario_logado = st.session_state.username
     nome_usuario = users[usuario_logado]["name"]
 
-    df_empresas, _ = carregar_base("empresas.csv")
-    df_projetos, _ = carregar_base("projetos.csv")
-    df_atividades, _ = carregar_base("atividades.csv")
+    bases = carregar_bases("empresas.csv", "projetos.csv", "atividades.csv")
+    df_empresas, _ = bases["empresas.csv"]
+    df_projetos, _ = bases["projetos.csv"]
+    df_atividades, _ = bases["atividades.csv"]
+
+    def enviar_lancamentos(novo):
+        # um envio (uma ou várias linhas) = um ticket na fila = um append_rows
+        ticket = enfileirar_linhas("timesheet.csv", novo)
+        st.session_state.setdefault("tickets_lancamento", []).append(ticket)
+        info = aguardar_ticket(ticket, FILA_ESPERA_ACK_SEG)
+        if info and info["status"] == "gravado":
+            st.success(f"✅ {len(novo)} registro(s) salvo(s) no Timesheet com sucesso!" if len(novo) > 1 else "✅ Registro salvo no Timesheet com sucesso!")
+            return True
+        if info and info["status"] == "erro":
+            st.error(f"❌ Não foi possível salvar o registro ({info['erro']}). Tente novamente.")
+        else:
+            st.info("⏳ Registro na fila de gravação. Acompanhe o status em 📬 Meus envios.")
+        return False
 
-    projeto = st.selectbox(
-        "Projeto",
-        sorted(df_projetos["Nome Projeto"].dropna().unique()) if not df_projetos.empty else ["Sem projetos cadastrados"]
-    )
+    modo = st.radio("Modo de lançamento", ["Lançamento único", "Grade semanal"], horizontal=True)
 
-    df_atividades_filtrado = df_atividades[df_atividades["Projeto Vinculado"].astype(str) == str(projeto)]
-    atividade = st.selectbox(
-        "Atividade",
-        sorted(df_atividades_filtrado["Nome Atividade"].dropna().unique()) if not df_atividades_filtrado.empty else ["Sem atividades para este projeto"]
-    )
+    if modo == "Lançamento único":
+        projeto = st.selectbox(
+            "Projeto",
+            sorted(df_projetos["Nome Projeto"].dropna().unique()) if not df_projetos.empty else ["Sem projetos cadastrados"]
+        )
 
-    squad = st.selectbox(
-        "Time",
-        sorted(df_projetos[df_projetos["Nome Projeto"].astype(str) == str(projeto)]["Time"].dropna().unique()) if not df_projetos.empty else ["Sem projetos cadastrados"]
-    )
+        df_atividades_filtrado = df_atividades[df_atividades["Projeto Vinculado"].astype(str) == str(projeto)]
+        atividade = st.selectbox(
+            "Atividade",
+            sorted(df_atividades_filtrado["Nome Atividade"].dropna().unique()) if not df_atividades_filtrado.empty else ["Sem atividades para este projeto"]
+        )
 
-    with st.form("form_timesheet"):
-        data_sel = st.date_input("Data", value=date.today())
-        empresa = st.selectbox(
-            "Empresa (Código SAP)",
-            sorted(df_empresas["Codigo SAP"].dropna().astype(str).unique()) if not df_empresas.empty else ["Sem empresas cadastradas"]
+        squad = st.selectbox(
+            "Time",
+            sorted(df_projetos[df_projetos["Nome Projeto"].astype(str) == str(projeto)]["Time"].dropna().unique()) if not df_projetos.empty else ["Sem projetos cadastrados"]
         )
-        quantidade = st.number_input("Quantidade Tarefas", min_value=0, step=1)
-        tempo = st.time_input("Horas Gastas", value=dt_time(0, 0))
-        horas = f"{tempo.hour:02d}:{tempo.minute:02d}"
-        observacoes = st.text_area("Observações", placeholder="Descreva detalhes relevantes sobre este lançamento...", height=120, max_chars=500)
-        if st.form_submit_button("💾 Registrar"):
-            if horas == "00:00":
-                st.warning("⚠️ O campo Horas Gastas não pode ser 00:00.")
-            elif not projeto or not atividade or not empresa:
-                st.warning("⚠️ Preencha todos os campos obrigatórios antes de registrar.")
+
+        with st.form("form_timesheet"):
+            data_sel = st.date_input("Data", value=date.today())
+            empresa = st.selectbox(
+                "Empresa (Código SAP)",
+                sorted(df_empresas["Codigo SAP"].dropna().astype(str).unique()) if not df_empresas.empty else ["Sem empresas cadastradas"]
+            )
+            quantidade = st.number_input("Quantidade Tarefas", min_value=0, step=1)
+            tempo = st.time_input("Horas Gastas", value=dt_time(0, 0))
+            horas = f"{tempo.hour:02d}:{tempo.minute:02d}"
+            observacoes = st.text_area("Observações", placeholder="Descreva detalhes relevantes sobre este lançamento...", height=120, max_chars=500)
+            if st.form_submit_button("💾 Registrar"):
+                if horas == "00:00":
+                    st.warning("⚠️ O campo Horas Gastas não pode ser 00:00.")
+                elif not projeto or not atividade or not empresa:
+                    st.warning("⚠️ Preencha todos os campos obrigatórios antes de registrar.")
+                else:
+                    id_registro = gerar_id_unico()
+                    datahora_lanc = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    novo = pd.DataFrame({
+                        "ID": [id_registro],
+                        "Usuário": [usuario_logado],
+                        "Nome": [nome_usuario],
+                        "Data": [data_sel.strftime('%Y-%m-%d')],
+                        "Empresa": [str(empresa)],
+                        "Projeto": [str(projeto)],
+                        "Time": [str(squad)],
+                        "Atividade": [str(atividade)],
+                        "Quantidade": [int(quantidade)],
+                        "Horas Gastas": [horas],
+                        "Minutos": [tempo.hour * 60 + tempo.minute],
+                        "Observações": [observacoes.replace('\n', ' ').replace(';', ',').strip()],
+                        "DataHoraLancamento": [datahora_lanc]
+                    })
+                    enviar_lancamentos(novo)
+
+    else:
+        st.caption("Uma linha por atividade; preencha as horas (HH:MM) nos dias trabalhados.")
+        referencia = st.date_input("Semana de", value=date.today())
+        segunda = referencia - timedelta(days=referencia.weekday())
+        colunas_dias = {
+            f"{nome} {(segunda + timedelta(days=i)).strftime('%d/%m')}": (segunda + timedelta(days=i)).strftime('%Y-%m-%d')
+            for i, nome in enumerate(["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"])
+        }
+        grade_vazia = pd.DataFrame({c: pd.Series(dtype="object") for c in ["Projeto", "Atividade", "Empresa", *colunas_dias, "Observações"]})
+        grade = st.data_editor(
+            grade_vazia,
+            num_rows="dynamic",
+            use_container_width=True,
+            hide_index=True,
+            key=f"grade_semanal_{st.session_state.get('grade_versao', 0)}",
+            column_config={
+                "Projeto": st.column_config.SelectboxColumn("Projeto", options=sorted(df_projetos["Nome Projeto"].dropna().astype(str).unique())),
+                "Atividade": st.column_config.SelectboxColumn("Atividade", options=sorted(df_atividades["Nome Atividade"].dropna().astype(str).unique())),
+                "Empresa": st.column_config.SelectboxColumn("Empresa", options=sorted(df_empresas["Codigo SAP"].dropna().astype(str).unique())),
+                **{c: st.column_config.TextColumn(c, help="HH:MM", max_chars=5) for c in colunas_dias},
+                "Observações": st.column_config.TextColumn("Observações", max_chars=500),
+            },
+        )
+
+        if st.button("💾 Registrar semana"):
+            # uma linha por célula preenchida (atividade × dia), validadas todas de uma vez
+            longo = grade.reset_index(drop=True).rename_axis("Linha").reset_index().melt(
+                id_vars=["Linha", "Projeto", "Atividade", "Empresa", "Observações"],
+                value_vars=list(colunas_dias), var_name="Dia", value_name="Valor",
+            )
+            longo = longo[longo["Valor"].fillna("").astype(str).str.strip() != ""].reset_index(drop=True)
+            longo["Horas Gastas"], longo["Minutos"] = interpretar_horas(longo["Valor"])
+
+            pares_validos = pd.MultiIndex.from_frame(df_atividades[["Projeto Vinculado", "Nome Atividade"]].astype(str))
+            problemas = pd.Series("", index=longo.index)
+            problemas[longo[["Projeto", "Atividade", "Empresa"]].isna().any(axis=1)] = "Projeto, atividade e empresa são obrigatórios"
+            vinculada = pd.MultiIndex.from_frame(longo[["Projeto", "Atividade"]].astype(str)).isin(pares_validos)
+            problemas[(problemas == "") & ~vinculada] = "Atividade não pertence ao projeto"
+            problemas[(problemas == "") & longo["Horas Gastas"].isna()] = "Horas inválidas (use HH:MM)"
+            problemas[(problemas == "") & ~minutos_validos(longo["Minutos"])] = "Horas devem ficar entre 1 minuto e 24 horas"
+
+            if longo.empty:
+                st.warning("⚠️ Preencha as horas de pelo menos um dia.")
+            elif (problemas != "").any():
+                erros = longo.loc[problemas != "", ["Linha", "Dia", "Valor"]].assign(Problema=problemas[problemas != ""])
+                erros["Linha"] = erros["Linha"] + 1
+                st.warning(f"⚠️ {len(erros)} célula(s) com problema. Nada foi registrado.")
+                st.dataframe(erros, use_container_width=True, hide_index=True)
             else:
-                id_registro = gerar_id_unico()
-                datahora_lanc = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                time_por_projeto = (
+                    df_projetos.dropna(subset=["Nome Projeto"])
+                    .assign(**{"Nome Projeto": lambda d: d["Nome Projeto"].astype(str)})
+                    .drop_duplicates("Nome Projeto")
+                    .set_index("Nome Projeto")["Time"]
+                )
                 novo = pd.DataFrame({
-                    "ID": [id_registro],
-                    "Usuário": [usuario_logado],
-                    "Nome": [nome_usuario],
-                    "Data": [data_sel.strftime('%Y-%m-%d')],
-                    "Empresa": [str(empresa)],
-                    "Projeto": [str(projeto)],
-                    "Time": [str(squad)],
-                    "Atividade": [str(atividade)],
-                    "Quantidade": [int(quantidade)],
-                    "Horas Gastas": [horas],
-                    "Observações": [observacoes.replace('\n', ' ').replace(';', ',').strip()],
-                    "DataHoraLancamento": [datahora_lanc]
+                    "ID": [gerar_id_unico() for _ in range(len(longo))],
+                    "Usuário": usuario_logado,
+                    "Nome": nome_usuario,
+                    "Data": longo["Dia"].map(colunas_dias),
+                    "Empresa": longo["Empresa"].astype(str),
+                    "Projeto": longo["Projeto"].astype(str),
+                    "Time": longo["Projeto"].astype(str).map(time_por_projeto).fillna("").astype(str),
+                    "Atividade": longo["Atividade"].astype(str),
+                    "Quantidade": 0,
+                    "Horas Gastas": longo["Horas Gastas"],
+                    "Minutos": longo["Minutos"],
+                    "Observações": longo["Observações"].fillna("").astype(str).str.replace('\n', ' ').str.replace(';', ',').str.strip(),
+                    "DataHoraLancamento": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                })
+                if enviar_lancamentos(novo):
+                    # limpa a grade
+                    st.session_state.grade_versao = st.session_state.get("grade_versao", 0) + 1
+
+    tickets = st.session_state.get("tickets_lancamento", [])
+    if tickets:
+        with st.expander("📬 Meus envios"):
+            st.button("🔄 Atualizar status")
+            rotulos = {"pendente": "⏳ Na fila", "gravado": "✅ Gravado", "erro": "❌ Erro"}
+            linhas = []
+            for ticket in reversed(tickets[-20:]):
+                info = status_ticket(ticket) or {}
+                linhas.append({
+                    "Ticket": ticket[:8],
+                    "Status": rotulos.get(info.get("status"), "Expirado"),
+                    "Enviado em": datetime.fromtimestamp(info["criado"]).strftime('%H:%M:%S') if info else "",
+                    "Lote": info.get("lote"),
+                    "Erro": info.get("erro") or "",
                 })
-                if append_rows("timesheet.csv", novo):
-                    st.success("✅ Registro salvo no Timesheet com sucesso!")
+            st.dataframe(pd.DataFrame(linhas), use_container_width=True, hide_index=True)
 
 # =============================================
 # CONTEÚDO: VISUALIZAR / EDITAR TS
@@ -768,71 +2901,53 @@ elif menu == "📄 Visualizar / Editar Timesheet":
     st.title("📄 Visualizar, Editar ou Excluir Timesheet")
     usuario_logado = st.session_state.username
 
-    df_ts, _ = carregar_base("timesheet.csv")
-    df_ts = normalizar_coluna_horas(df_ts)
-    df_ts = tratar_coluna_data(df_ts)
-
-    if usuario_logado not in ADMIN_USERS:
-        df_ts = df_ts[df_ts["Usuário"] == usuario_logado]
-
     st.sidebar.subheader("🔍 Filtros")
-    if df_ts.empty:
-        period = [date.today(), date.today()]
-    else:
-        period = [
-            (df_ts["Data"].min().date() if pd.notnull(df_ts["Data"].min()) else date.today()),
-            (df_ts["Data"].max().date() if pd.notnull(df_ts["Data"].max()) else date.today())
-        ]
-    data_inicial, data_final = st.sidebar.date_input("Período:", period)
+    data_inicial, data_final = st.sidebar.date_input("Período:", intervalo_base("timesheet.csv"))
 
-    empresa = st.sidebar.selectbox("Empresa:", ["Todas"] + sorted(df_ts["Empresa"].dropna().unique().tolist()) if not df_ts.empty else ["Todas"])
-    projeto = st.sidebar.selectbox("Projeto:", ["Todos"] + sorted(df_ts["Projeto"].dropna().unique().tolist()) if not df_ts.empty else ["Todos"])
-    squad = st.sidebar.selectbox("Time:", ["Todos"] + sorted(df_ts["Time"].dropna().unique().tolist()) if not df_ts.empty else ["Todos"])
-    atividade = st.sidebar.selectbox("Atividade:", ["Todas"] + sorted(df_ts["Atividade"].dropna().unique().tolist()) if not df_ts.empty else ["Todas"])
+    df_ts, _ = carregar_base("timesheet.csv", periodo=(data_inicial, data_final))
+    df_ts = tratar_coluna_data(df_ts)
 
-    if usuario_logado in ADMIN_USERS:
-        usuario_sel = st.sidebar.selectbox("Nome:", ["Todos"] + sorted(df_ts["Nome"].dropna().unique().tolist()) if not df_ts.empty else ["Todos"])
-    else:
-        usuario_sel = usuario_logado
+    if usuario_logado not in ADMIN_USERS:
+        df_ts = df_ts[mascara_filtros(df_ts, filtros={"Usuário": [usuario_logado]})]
 
-    df_f = df_ts.copy()
-    if empresa != "Todas":
-        df_f = df_f[df_f["Empresa"] == empresa]
-    if projeto != "Todos":
-        df_f = df_f[df_f["Projeto"] == projeto]
-    if squad != "Todos":
-        df_f = df_f[df_f["Time"] == squad]
-    if atividade != "Todas":
-        df_f = df_f[df_f["Atividade"] == atividade]
-    if usuario_sel != "Todos":
-        df_f = df_f[df_f["Usuário"] == usuario_sel]
-
-    df_f = df_f[(df_f["Data"].dt.date >= data_inicial) & (df_f["Data"].dt.date <= data_final)].sort_values(by="Data")
+    # só o administrador vê (e filtra) os lançamentos dos outros colaboradores
+    dimensoes = ["Empresa", "Projeto", "Time", "Atividade"] + (["Nome"] if usuario_logado in ADMIN_USERS else [])
+    filtros = filtros_barra_lateral(df_ts, dimensoes)
+    df_f = df_ts[mascara_filtros(df_ts, (data_inicial, data_final), filtros)].sort_values(by="Data")
 
     df_visual = df_f.copy()
     df_visual["Data"] = df_visual["Data"].dt.strftime("%d/%m/%Y")
     df_visual = df_visual.rename(columns={"DataHoraLancamento": "Data de Registro"})
 
-    cols_ordem = [c for c in df_visual.columns if c not in ["ID", "Data de Registro"]] + ["Data de Registro", "ID"]
+    # Minutos é a mesma informação de Horas Gastas, para as consultas
+    cols_ordem = [c for c in df_visual.columns if c not in ["ID", "Data de Registro", "Minutos"]] + ["Data de Registro", "ID"]
     df_visual = df_visual[cols_ordem]
 
     st.markdown(f"### 🔍 {len(df_visual)} registros encontrados")
     if df_visual.empty:
         st.info("🚩 Nenhum registro encontrado com os filtros aplicados.")
         st.stop()
-    else:
-        st.dataframe(df_visual, use_container_width=True)
 
-    st.markdown("---")
-    st.subheader("✏️ Editar um Registro")
-    indice = st.selectbox("Selecione o índice para editar:", df_f.index.tolist())
-    linha = df_f.loc[indice]
+    # seleção múltipla: a edição e a exclusão valem para todas as linhas marcadas
+    selecionar_todos = st.checkbox(f"Selecionar todos os {len(df_visual)} registros filtrados")
+    grade = st.data_editor(
+        df_visual.assign(**{"✔": selecionar_todos})[["✔", *cols_ordem]],
+        use_container_width=True,
+        hide_index=True,
+        disabled=cols_ordem,
+        key=f"selecao_ts_{selecionar_todos}",
+    )
+    ids_sel = grade.loc[grade["✔"], "ID"].dropna().tolist()
+    df_sel = df_f[df_f["ID"].isin(ids_sel)]
+    datas_atuais = dict(zip(df_sel["ID"], df_sel["Data"]))
 
+    st.markdown("---")
+    st.subheader(f"✏️ Editar {len(ids_sel)} registro(s) selecionado(s)")
     col_editar = st.selectbox("Coluna:", [
         "Data", "Nome", "Empresa", "Projeto", "Atividade", "Quantidade", "Horas Gastas", "Observações"
     ])
 
-    valor_atual = linha[col_editar]
+    valor_atual = df_sel[col_editar].iloc[0] if not df_sel.empty else None
     if col_editar == "Data":
         novo_valor = st.date_input("Nova Data", value=valor_atual.date() if pd.notnull(valor_atual) else date.today())
         novo_valor = pd.to_datetime(novo_valor).strftime('%Y-%m-%d')
@@ -841,32 +2956,33 @@ elif menu == "📄 Visualizar / Editar Timesheet":
     else:
         novo_valor = st.text_input("Novo Valor", value=str(valor_atual) if pd.notnull(valor_atual) else "").replace('\n', ' ').replace(';', ',').strip()
 
-    if st.button("💾 Atualizar Registro"):
-        id_editar = linha.get("ID", "")
-        if not id_editar:
-            st.error("❌ Este registro não possui ID. Não é possível editar com segurança.")
+    if st.button("💾 Atualizar Selecionados"):
+        if not ids_sel:
+            st.warning("⚠️ Marque ao menos um registro com ID na tabela.")
+        elif col_editar == "Horas Gastas" and not minutos_validos(minutos_horas(novo_valor)):
+            st.warning("⚠️ Informe as horas no formato HH:MM, de 1 minuto a 24 horas.")
         else:
-            ok = update_row_by_id("timesheet.csv", id_editar, {col_editar: novo_valor})
+            if col_editar == "Horas Gastas":
+                novo_valor = formatar_horas(novo_valor)
+            ok = update_rows_by_id("timesheet.csv", {i: {col_editar: novo_valor} for i in ids_sel}, datas_atuais)
             if ok:
-                st.success("✅ Registro atualizado com sucesso!")
+                st.success(f"✅ {len(ids_sel)} registro(s) atualizado(s) com sucesso!")
                 st.rerun()
 
     st.markdown("---")
-    st.subheader("🗑️ Excluir um Registro")
-    indice_excluir = st.selectbox("Índice para excluir:", df_f.index.tolist(), key="excluir")
-    linha_x = df_f.loc[indice_excluir]
-    st.markdown("**Registro selecionado:**")
-    st.json({k: (v.strftime('%Y-%m-%d') if isinstance(v, (pd.Timestamp,)) else (v if pd.notnull(v) else None)) for k, v in linha_x.to_dict().items()})
+    st.subheader(f"🗑️ Excluir {len(ids_sel)} registro(s) selecionado(s)")
+    if len(ids_sel) == 1:
+        st.markdown("**Registro selecionado:**")
+        st.json({k: (v.strftime('%Y-%m-%d') if isinstance(v, (pd.Timestamp,)) else (v if pd.notnull(v) else None)) for k, v in df_sel.iloc[0].to_dict().items()})
 
     confirmar = st.radio("⚠️ Confirmar Exclusão?", ["Não", "Sim"], horizontal=True, key="confirmar_excluir")
     if confirmar == "Sim" and st.button("🗑️ Confirmar Exclusão"):
-        id_excluir = linha_x.get("ID", "")
-        if not id_excluir:
-            st.error("❌ Este registro não possui ID. Não é possível excluir com segurança.")
+        if not ids_sel:
+            st.warning("⚠️ Marque ao menos um registro com ID na tabela.")
         else:
-            ok = delete_row_by_id("timesheet.csv", id_excluir)
+            ok = delete_rows_by_id("timesheet.csv", ids_sel, datas_atuais)
             if ok:
-                st.success("✅ Registro excluído com sucesso!")
+                st.success(f"✅ {len(ids_sel)} registro(s) excluído(s) com sucesso!")
                 st.rerun()
 
     st.markdown("---")
@@ -884,7 +3000,6 @@ elif menu == "📊 Avaliação de Performance — IA":
     usuario_logado = st.session_state.username
 
     df_ts, _ = carregar_base("timesheet.csv")
-    df_ts = normalizar_coluna_horas(df_ts)
     df_ts["Data"] = pd.to_datetime(df_ts["Data"], errors="coerce")
 
     if df_ts.empty:
@@ -928,7 +3043,7 @@ elif menu == "📊 Avaliação de Performance — IA":
 
     client = OpenAI(api_key=st.secrets["openai"]["api_key"])
 
-    dados_markdown = df_f.fillna("").astype(str).to_markdown(index=False)
+    dados_markdown = df_f.drop(columns=["Minutos"], errors="ignore").astype(object).fillna("").astype(str).to_markdown(index=False)
     prompt = f"""
     Você é um consultor especialista em gestão de tempo, produtividade e análise de performance.
 
@@ -986,3 +3101,90 @@ elif menu == "📊 Avaliação de Performance — IA":
                 file_name="relatorio_performance.docx",
                 mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
             )
+
+# =============================================
+# CONTEÚDO: IMPORTAÇÃO EM LOTE
+# =============================================
+
+elif menu == "📥 Importação em Lote":
+    st.title("📥 Importação em Lote de Timesheet")
+    if st.session_state.username not in ADMIN_USERS:
+        st.error("Acesso restrito aos administradores.")
+        st.stop()
+
+    arquivo = st.file_uploader("Arquivo CSV ou XLSX", type=["csv", "xlsx"])
+    if arquivo is None:
+        st.info("Envie a planilha com os lançamentos (uma linha por lançamento, com cabeçalho).")
+        st.stop()
+
+    separador = CSV_SEP
+    if not arquivo.name.lower().endswith(".xlsx"):
+        separador = st.selectbox("Separador do CSV", [";", ",", "\t"], format_func=lambda s: "TAB" if s == "\t" else s)
+
+    # a leitura fica na sessão: os reruns do mapeamento não relêem o arquivo
+    chave_arquivo = (arquivo.name, arquivo.size, separador)
+    if st.session_state.get("importacao_arquivo", {}).get("chave") != chave_arquivo:
+        if arquivo.name.lower().endswith(".xlsx"):
+            df_origem = pd.read_excel(arquivo)
+        else:
+            df_origem = pd.read_csv(arquivo, sep=separador, dtype=str, encoding=CSV_ENC)
+        st.session_state.importacao_arquivo = {"chave": chave_arquivo, "df": df_origem}
+        st.session_state.pop("importacao", None)
+    df_origem = st.session_state.importacao_arquivo["df"]
+    st.caption(f"{len(df_origem):,} linhas · {len(df_origem.columns)} colunas".replace(",", "."))
+    st.dataframe(df_origem.head(20), use_container_width=True, hide_index=True)
+
+    st.subheader("🔗 Mapeamento de colunas")
+    obrigatorias = ["Usuário", "Data", "Empresa", "Projeto", "Atividade", "Horas Gastas"]
+    opcionais = ["Nome", "Time", "Quantidade", "Observações"]
+    opcoes = ["(não mapear)"] + list(df_origem.columns)
+    por_nome = {str(c).strip().lower(): c for c in df_origem.columns}
+    mapa = {}
+    cols = st.columns(3)
+    for i, coluna in enumerate(obrigatorias + opcionais):
+        padrao = por_nome.get(coluna.lower())
+        escolha = cols[i % 3].selectbox(
+            f"{coluna}{' *' if coluna in obrigatorias else ''}", opcoes,
+            index=opcoes.index(padrao) if padrao in opcoes else 0, key=f"mapa_{coluna}",
+        )
+        mapa[coluna] = None if escolha == "(não mapear)" else escolha
+
+    if st.button("🔎 Validar"):
+        faltando = [c for c in obrigatorias if mapa[c] is None]
+        if faltando:
+            st.warning(f"⚠️ Mapeie as colunas obrigatórias: {', '.join(faltando)}.")
+        else:
+            bases = carregar_bases("empresas.csv", "projetos.csv", "atividades.csv")
+            validas, erros = validar_importacao_timesheet(
+                df_origem, mapa, users,
+                bases["empresas.csv"][0], bases["projetos.csv"][0], bases["atividades.csv"][0],
+            )
+            st.session_state.importacao = {"chave": chave_arquivo, "validas": validas, "erros": erros}
+
+    resultado = st.session_state.get("importacao")
+    if resultado and resultado["chave"] == chave_arquivo:
+        validas, erros = resultado["validas"], resultado["erros"]
+        c1, c2 = st.columns(2)
+        c1.metric("✅ Linhas válidas", len(validas))
+        c2.metric("❌ Linhas com erro", len(erros))
+        if not erros.empty:
+            st.dataframe(erros.head(1000), use_container_width=True, hide_index=True)
+            st.download_button("📥 Baixar relatório de erros", data=_df_to_csv_bytes(erros),
+                               file_name="importacao_erros.csv", mime="text/csv")
+        # os IDs são gerados na validação: reimportar depois de uma falha não duplica linhas
+        if not validas.empty and st.button(f"💾 Importar {len(validas)} linhas válidas"):
+            progresso = st.progress(0.0, text="Gravando...")
+            gravadas, falhas, lotes_falhos = 0, 0, 0
+            for n, total, linhas, ok in importar_linhas("timesheet.csv", validas, owner=st.session_state.username):
+                gravadas += linhas if ok else 0
+                falhas += 0 if ok else linhas
+                lotes_falhos += 0 if ok else 1
+                progresso.progress(n / total, text=f"Lote {n}/{total}")
+            if not gravadas:
+                st.error(f"❌ Nenhuma linha gravada: {lotes_falhos} de {total} lote(s) falharam (sistema ocupado). "
+                         "Clique em importar novamente.")
+            elif falhas:
+                st.warning(f"⚠️ Importação parcial: {gravadas} linhas gravadas; {lotes_falhos} de {total} lote(s) "
+                           f"({falhas} linhas) falharam. Clique em importar novamente para concluir.")
+            else:
+                st.success(f"✅ {gravadas} linhas importadas.")